@@ -0,0 +1,195 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from foodhub import Catalog
+from render import snapshot_item
+
+# read-only JSON view of the catalog for kiosks and mobile clients, served
+# straight from the Shop snapshots without going through a Streamlit rerun.
+#
+#   GET /shops?cursor=&limit=            shop list (Catalog.page_shops)
+#   GET /shops/<id>                      one shop with its full menu
+#   GET /search?q=&limit=                ranked search (Catalog.search)
+#   GET /items?min_price=&max_price=&available=1&status=Open&category=&sort=desc&offset=&limit=
+#   GET /metrics                         instrumentation, Prometheus text format (metrics.py)
+#
+# every response carries an ETag built from the relevant version and honours
+# If-None-Match; bodies are gzipped when the client accepts it.
+
+# versions restart at zero with the process, so tags carry a per-process id
+BOOT = uuid.uuid4().hex[:8]
+MAX_LIMIT = 200
+GZIP_MIN_BYTES = 512
+
+
+def item_json(it) -> dict:
+    return {'item_id': it.item_id, 'name': it.name, 'price': it.price, 'available': it.available}
+
+
+def listing_json(summary) -> dict:
+    # a /shops entry: only what listing_version covers, so its tag stays valid
+    return {'shop_id': summary.shop_id, 'name': summary.name, 'status': summary.status}
+
+
+def shop_json(snap) -> dict:
+    out = listing_json(snap)
+    out['version'] = snap.version
+    return out
+
+
+def menu_json(snap) -> dict:
+    out = shop_json(snap)
+    out['categories'] = [{'name': cat.name, 'items': [item_json(it) for it in cat.items]} for cat in snap.categories]
+    return out
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    catalog: Catalog = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.catalog.sync()
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p]
+        try:
+            if parts == ['shops']:
+                self.shops(params)
+            elif len(parts) == 2 and parts[0] == 'shops':
+                self.shop(parts[1])
+            elif parts == ['search']:
+                self.search(params)
+            elif parts == ['items']:
+                self.items(params)
+            elif parts == ['metrics']:
+                self.send_body(200, metrics.prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            else:
+                self.send_json(404, {'error': 'not found'})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+
+    def limit(self, params, default=20) -> int:
+        return max(1, min(int(params.get('limit', default)), MAX_LIMIT))
+
+    def shops(self, params):
+        tag = f'W/"{BOOT}-shops-{self.catalog.listing_version}"'
+        if self.not_modified(tag):
+            return
+        shops, nxt = self.catalog.page_shops(params.get('cursor'), self.limit(params))
+        self.send_json(200, {'shops': [listing_json(s.summary) for s in shops], 'next': nxt}, tag)
+
+    def shop(self, shop_id: str):
+        shop = self.catalog.use(shop_id)
+        if not shop:
+            self.send_json(404, {'error': f'unknown shop {shop_id}'})
+            return
+        snap = shop.snapshot
+        tag = f'W/"{BOOT}-{snap.shop_id}-{snap.version}"'
+        if self.not_modified(tag):
+            return
+        self.send_json(200, menu_json(snap), tag)
+
+    def search(self, params):
+        query = params.get('q', '')
+        tag = f'W/"{BOOT}-catalog-{self.catalog.version}"'
+        if self.not_modified(tag):
+            return
+        results, total = self.catalog.search(query, self.limit(params)) if query.strip() else ([], 0)
+        out = []
+        for key, payload, score in results:
+            if key[0] == 'shop':
+                out.append({'type': 'shop', 'score': score, 'shop': shop_json(payload.summary)})
+            else:
+                cat, it = payload
+                view = snapshot_item(self.catalog.get(key[1]), cat.name, it.item_id)
+                if view:
+                    out.append({'type': 'item', 'score': score, 'shop_id': key[1], 'category': cat.name, 'item': item_json(view)})
+        self.send_json(200, {'query': query, 'total': total, 'results': out}, tag)
+
+    def items(self, params):
+        tag = f'W/"{BOOT}-catalog-{self.catalog.version}"'
+        if self.not_modified(tag):
+            return
+        flag = params.get('available')
+        rows, nxt = self.catalog.query_items(
+            min_price=float(params['min_price']) if 'min_price' in params else None,
+            max_price=float(params['max_price']) if 'max_price' in params else None,
+            available=None if flag is None else flag.lower() in ('1', 'true', 'yes'),
+            status=params.get('status'), category=params.get('category'), shop_id=params.get('shop_id'),
+            descending=params.get('sort') == 'desc', offset=int(params.get('offset', 0)), limit=self.limit(params))
+        out = []
+        for shop, cat, it in rows:
+            view = snapshot_item(shop, cat.name, it.item_id)
+            if view:
+                out.append({'shop_id': shop.shop_id, 'shop_status': shop.status, 'category': cat.name, 'item': item_json(view)})
+        self.send_json(200, {'items': out, 'next_offset': nxt}, tag)
+
+    def not_modified(self, tag: str) -> bool:
+        if tag not in (t.strip() for t in self.headers.get('If-None-Match', '').split(',')):
+            return False
+        self.send_response(304)
+        self.send_header('ETag', tag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+
+    def send_json(self, code: int, payload, tag: str = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_body(code, body, 'application/json; charset=utf-8', tag)
+
+    def send_body(self, code: int, body: bytes, content_type: str, tag: str = None):
+        gzipped = len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            body = gzip.compress(body, compresslevel=5)
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        if tag:
+            self.send_header('ETag', tag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(catalog: Catalog, host: str = '127.0.0.1', port: int = 8502) -> ThreadingHTTPServer:
+    handler = type('CatalogApiHandler', (ApiHandler,), {'catalog': catalog})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_thread(catalog: Catalog, host: str = '127.0.0.1', port: int = 8502) -> ThreadingHTTPServer:
+    # used by the Streamlit app to expose its own in-process catalog
+    server = make_server(catalog, host, port)
+    threading.Thread(target=server.serve_forever, name='foodhub-api', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    # standalone: serve whatever is stored in FOODHUB_DB; with the SQLite
+    # backend, edits made through the Streamlit app show up via Catalog.sync()
+    import argparse
+    from storage import SQLiteStorage
+
+    parser = argparse.ArgumentParser(description='FoodHub read-only JSON API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--db', default=os.environ.get('FOODHUB_DB', 'foodhub.db'))
+    args = parser.parse_args()
+
+    catalog = Catalog(SQLiteStorage(args.db))
+    catalog.load()
+    print(f"serving {len(catalog.shops)} shops on http://{args.host}:{args.port}")
+    make_server(catalog, args.host, args.port).serve_forever()
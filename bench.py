@@ -0,0 +1,185 @@
+import argparse
+import json
+import platform
+import random
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import catalog_snapshot
+import render
+from foodhub import Catalog, Item, Menu, Shop
+
+# microbenchmarks for the core data structures on a synthetic catalog.
+#
+#   python bench.py --shops 50 --categories 10 --items 200 --out bench.json
+#   python bench.py ... --compare old.json      # ratios against a previous run
+#
+# output is one JSON document: run metadata plus, per benchmark, the number of
+# operations timed and the best-of-repeat per-op time in microseconds.
+
+WORDS = ['chicken', 'pork', 'beef', 'tofu', 'rice', 'noodle', 'sisig', 'adobo', 'bbq', 'iced', 'tea',
+         'coffee', 'cake', 'mango', 'ube', 'halo', 'lumpia', 'pancit', 'siomai', 'garlic', 'spicy', 'sweet']
+
+
+def synthetic_catalog(shops: int, categories: int, items: int, seed: int = 0, columnar: bool = False) -> Catalog:
+    # items is per category; ids are unique per shop like the app requires
+    rng = random.Random(seed)
+    catalog = Catalog(columnar=columnar)
+    for s in range(shops):
+        shop = Shop(f's{s}', f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {s}", 'pw', columnar)
+        shop.status = rng.choice(['Open', 'Closed', 'Preparing'])
+        rows = []
+        for c in range(categories):
+            for i in range(items):
+                rows.append((f'cat{c}', f'c{c}i{i}', f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}',
+                             round(rng.uniform(10, 500), 2), rng.random() > 0.2))
+        shop.bulk_add(rows)
+        catalog.add_shop(shop)
+    return catalog
+
+
+def timed(fn, repeat: int):
+    # best of `repeat` runs, in seconds
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(shops: int, categories: int, items: int, repeat: int, seed: int, columnar: bool):
+    results = {}
+
+    def record(name: str, ops: int, fn):
+        seconds = timed(fn, repeat)
+        results[name] = {'ops': ops, 'seconds': seconds, 'us_per_op': seconds / ops * 1e6}
+        print(f"{name:32s} {ops:>9d} ops  {seconds / ops * 1e6:10.3f} us/op", file=sys.stderr)
+
+    n = items
+    ids = [f'i{i}' for i in range(n)]
+
+    def menu_insert():
+        m = Menu(columnar)
+        for i in ids:
+            m.insert(Item(i, 'x', 1.0))
+    record('menu.insert', n, menu_insert)
+
+    menu = Menu(columnar)
+    for i in ids:
+        menu.insert(Item(i, 'x', 1.0))
+    record('menu.find', n, lambda: [menu.find(i) for i in ids])
+
+    def menu_delete():
+        m = Menu(columnar)
+        for i in ids:
+            m.insert(Item(i, 'x', 1.0))
+        for i in ids:
+            m.delete(i)
+    # reported per insert+delete pair
+    record('menu.insert+delete', n, menu_delete)
+
+    start = time.perf_counter()
+    catalog = synthetic_catalog(shops, categories, items, seed, columnar)
+    build = time.perf_counter() - start
+    total_items = shops * categories * items
+    results['catalog.build'] = {'ops': total_items, 'seconds': build, 'us_per_op': build / max(total_items, 1) * 1e6}
+    print(f"{'catalog.build':32s} {total_items:>9d} ops  {build / max(total_items, 1) * 1e6:10.3f} us/op", file=sys.stderr)
+
+    rng = random.Random(seed)
+    shop_list = catalog.list_shops()
+    probes = [(rng.choice(shop_list), f'c{rng.randrange(categories)}i{rng.randrange(items)}') for _ in range(1000)]
+    record('shop.find_item', len(probes), lambda: [shop.find_item(i) for shop, i in probes])
+    record('category.traverse_preorder', len(shop_list),
+           lambda: [sum(1 for _ in shop.menu_tree.traverse_preorder()) for shop in shop_list])
+
+    queries = [rng.choice(WORDS)[:k] for k in (2, 3, 5) for _ in range(20)] + ['zzzz'] * 5
+    record('search_index.search', len(queries), lambda: [catalog.search_index.search(q) for q in queries])
+
+    def cold_search():
+        catalog.search_cache.clear()
+        for q in queries:
+            catalog.search(q, 20)
+    record('catalog.search (cold)', len(queries), cold_search)
+    record('catalog.search (cached)', len(queries), lambda: [catalog.search(q, 20) for q in queries])
+    prefixes = [rng.choice(WORDS)[:k] for k in (1, 2, 4) for _ in range(20)] + [f's{rng.randrange(shops)}' for _ in range(20)]
+    record('catalog.find_shops', len(prefixes), lambda: [catalog.find_shops(p, 8) for p in prefixes])
+    record('catalog.query_items', 100, lambda: [catalog.query_items(max_price=100, available=True, status='Open', limit=20)
+                                                 for _ in range(100)])
+
+    def render_cold():
+        render._menu_cache.clear()
+        for shop in shop_list:
+            render.menu_html(shop)
+    record('render.menu_html (cold)', len(shop_list), render_cold)
+    record('render.menu_html (cached)', len(shop_list), lambda: [render.menu_html(shop) for shop in shop_list])
+
+    order_shop = shop_list[0]
+    orderable = [i for i, (_, it) in order_shop.items.items() if it.available][:3]
+    order_shop.orders.limit = n * repeat
+    if orderable:
+        record('orders.place', n, lambda: [order_shop.orders.place('bench', {i: 1 for i in orderable}) for _ in range(n)])
+        # drains what orders.place queued, one batch of 10 at a time
+        record('orders.pop+complete', n, lambda: [order_shop.orders.complete([o.order_id for o in order_shop.orders.pop(10)])
+                                                  for _ in range(n // 10)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.snap')
+        record('snapshot.write', len(shop_list), lambda: catalog_snapshot.write_snapshot(catalog, path))
+        record('snapshot.load', len(shop_list),
+               lambda: catalog_snapshot.load_snapshot(Catalog(columnar=columnar), path))
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'git': git_rev(),
+            'shops': shops, 'categories': categories, 'items_per_category': items,
+            'repeat': repeat, 'seed': seed, 'columnar': columnar,
+        },
+        'results': results,
+    }
+
+
+def git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict):
+    print(f"\n{'benchmark':32s} {'base us/op':>12s} {'new us/op':>12s} {'ratio':>8s}", file=sys.stderr)
+    for name, new in report['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        ratio = new['us_per_op'] / old['us_per_op'] if old['us_per_op'] else float('inf')
+        print(f"{name:32s} {old['us_per_op']:12.3f} {new['us_per_op']:12.3f} {ratio:7.2f}x", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FoodHub data structure benchmarks')
+    parser.add_argument('--shops', type=int, default=20)
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--items', type=int, default=200, help='items per category')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--columnar', action='store_true')
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='previous JSON report to compare against')
+    args = parser.parse_args()
+
+    report = run(args.shops, args.categories, args.items, args.repeat, args.seed, args.columnar)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,216 @@
+import functools
+import gc
+import marshal
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from foodhub import Catalog, Shop
+
+# binary snapshot of a whole catalog, for fast cold starts: every shop's menu
+# plus both indexes, so a restart neither re-tokenizes every name for search
+# nor re-sorts every price.
+#
+#   MAGIC | header offset (u64) | header length (u32) | sections... | header
+#
+# the header (marshal) holds the shop directory and the offsets of the other
+# sections. each shop's menu is its own marshal block in the same row shape
+# storage uses; the search postings are one flat array of u32 key ordinals
+# that stays in the mapped file and is read one gram at a time on first use
+# (see SearchIndex.restore). marshal's format is tied to the Python version,
+# so a snapshot from another version is ignored and the catalog is loaded
+# from storage as usual.
+#
+# the snapshot records the storage's write position (Storage.mark); shops
+# written after it are re-read from storage on load, and a snapshot older
+# than the storage keeps history for is ignored. loading builds no menus:
+# each shop reads its own block the first time it is used (Shop.set_source).
+
+MAGIC = b'FHSNAP1\n'
+HEADER = struct.Struct('<QI')
+# how often the app rewrites the snapshot, if the catalog changed
+SNAPSHOT_INTERVAL = 300
+
+
+def _compat():
+    return (sys.version_info[:2], marshal.version, sys.byteorder, array('I').itemsize)
+
+
+def capture(catalog: Catalog):
+    # consistent cut of the catalog -> (header dict, [section bytes]).
+    # other processes' writes are caught up first and sync is held off, so
+    # nothing before the mark is missing from memory; add_shop registers
+    # under catalog.lock, so the mark and the shop list agree; then every
+    # shop lock and both index locks are held while the in-memory state is
+    # copied (writers take a shop lock first, then the indexes, so this order
+    # can't deadlock). unloaded menus aren't read until the locks are
+    # released, and nothing is serialized under them: a later write to such
+    # a shop is past the mark, so it is re-read from storage on load anyway
+    held = []
+    with catalog.sync_lock:
+        catalog.catch_up()
+        with catalog.lock:
+            shops = [catalog.shops[i] for i in catalog.shop_order]
+            mark = catalog.storage.mark()
+        try:
+            for shop in shops:
+                shop.lock.acquire()
+                held.append(shop.lock)
+            for lock in (catalog.search_index.lock, catalog.query_index.lock):
+                lock.acquire()
+                held.append(lock)
+            readers = [shop.menu_reader() for shop in shops]
+            directory = [(shop.shop_id, shop.name, shop.password, shop.status) for shop in shops]
+            search = catalog.search_index.export()
+            query = catalog.query_index.export()
+        finally:
+            for lock in reversed(held):
+                lock.release()
+    menus = [marshal.dumps(read()) for read in readers]
+    keys, docs, grams, postings = catalog.search_index.pack(search)
+
+    sections = []
+
+    def section(blob: bytes):
+        sections.append(blob)
+        return len(sections) - 1
+
+    header = {
+        'compat': _compat(),
+        'written_at': time.time(),
+        'mark': mark,
+        'shops': [row + (section(menu),) for row, menu in zip(directory, menus)],
+        'search_keys': section(marshal.dumps(keys)),
+        'search_docs': section(marshal.dumps(docs)),
+        'search_grams': section(marshal.dumps(grams)),
+        'search_postings': section(postings.tobytes()),
+        'query': section(marshal.dumps(query)),
+    }
+    return header, sections
+
+
+def write_snapshot(catalog: Catalog, path: str) -> int:
+    # atomic: written to a temp file next to path, fsynced, then renamed over
+    # it, so a reader (or a crash) only ever sees a complete file. returns
+    # the size in bytes
+    header, sections = capture(catalog)
+    offset = len(MAGIC) + HEADER.size
+    spans = []
+    for blob in sections:
+        spans.append((offset, len(blob)))
+        offset += len(blob)
+    blob = marshal.dumps(dict(header, sections=spans))
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(offset, len(blob)))
+            for section in sections:
+                f.write(section)
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return offset + len(blob)
+
+
+def load_snapshot(catalog: Catalog, path: str) -> int:
+    # fill an empty catalog from path; returns how many shops were loaded, or
+    # 0 if there is no usable snapshot (the caller then falls back to
+    # Catalog.load). the cyclic GC is paused meanwhile: it would otherwise
+    # rescan the freshly built objects over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load(catalog, path)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _load(catalog: Catalog, path: str) -> int:
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return 0
+    if mm[:len(MAGIC)] != MAGIC:
+        return 0
+    try:
+        start, size = HEADER.unpack_from(mm, len(MAGIC))
+        header = marshal.loads(mm[start:start + size])
+    except (struct.error, EOFError, ValueError, TypeError):
+        return 0
+    if header.get('compat') != _compat():
+        return 0
+    changed = catalog.storage.changed_since(header['mark'])
+    if changed is None:
+        return 0
+    spans = header['sections']
+
+    def read(n: int):
+        offset, length = spans[n]
+        return marshal.loads(mm[offset:offset + length])
+
+    for shop_id, name, password, status, menu in header['shops']:
+        shop = Shop(shop_id, name, password, catalog.columnar, status)
+        # the mapping stays open while any shop still has its block unread
+        shop.set_source(functools.partial(read, menu))
+        catalog.add_shop(shop, persist=False, index=False)
+    offset, length = spans[header['search_postings']]
+    # stays mapped for as long as the index has unread grams
+    postings = memoryview(mm)[offset:offset + length].cast('I')
+    catalog.search_index.restore(read(header['search_keys']), read(header['search_docs']),
+                                 read(header['search_grams']), postings)
+    catalog.query_index.restore(read(header['query']))
+    # orders are not in the snapshot
+    catalog.load_orders()
+    # writes that landed after the snapshot was taken
+    for shop_id in changed:
+        catalog.refresh_shop(shop_id)
+    return len(header['shops'])
+
+
+def start_writer(catalog: Catalog, path: str, interval: float = SNAPSHOT_INTERVAL, now: bool = False):
+    # daemon thread rewriting the snapshot every interval seconds while the
+    # catalog keeps changing (now=True also writes one straight away)
+    def run():
+        written = None if now else catalog.version
+        while True:
+            if catalog.version != written:
+                written = catalog.version
+                try:
+                    write_snapshot(catalog, path)
+                except Exception as e:
+                    print(f"catalog snapshot to {path} failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+    thread = threading.Thread(target=run, name='foodhub-snapshot', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    # offline: python catalog_snapshot.py --db foodhub.db --out foodhub.snap
+    import argparse
+    from storage import SQLiteStorage
+
+    parser = argparse.ArgumentParser(description='Write a FoodHub catalog snapshot from the database')
+    parser.add_argument('--db', default=os.environ.get('FOODHUB_DB', 'foodhub.db'))
+    parser.add_argument('--out', default=os.environ.get('FOODHUB_SNAPSHOT', 'foodhub.snap'))
+    args = parser.parse_args()
+
+    catalog = Catalog(SQLiteStorage(args.db))
+    started = time.perf_counter()
+    catalog.load()
+    loaded = time.perf_counter()
+    size = write_snapshot(catalog, args.out)
+    print(f"{len(catalog.shops)} shops: loaded in {loaded - started:.2f}s, "
+          f"wrote {size / 2**20:.1f} MB in {time.perf_counter() - loaded:.2f}s")
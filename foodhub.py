@@ -0,0 +1,1630 @@
+import bisect
+import heapq
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from itertools import islice
+from types import MappingProxyType
+from typing import Optional, List
+
+import metrics
+from storage import Storage
+
+
+class Item:
+    __slots__ = ('item_id', 'name', 'price', 'available', 'prev', 'next', 'slot')
+
+    def __init__(self, item_id: str, name: str, price: float, available: bool=True):
+        self.item_id = item_id
+        self.name = name
+        self.price = price
+        self.available = available
+        self.prev = None
+        self.next = None
+        # position in the owning Menu's columns (columnar mode only)
+        self.slot = -1
+
+class Menu:
+    # doubly linked list + item_id index, so insert/find/delete/move are O(1).
+    # in columnar mode price and availability are mirrored into flat arrays
+    # (slot order, not menu order) so aggregates run in C instead of a Python loop
+    def __init__(self, columnar: bool = False):
+        self.head: Optional[Item] = None
+        self.tail: Optional[Item] = None
+        self.index = {}
+        self.columnar = columnar
+        self.prices = array('d')
+        self.avail = bytearray()
+        self.slots: List[Item] = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        cur = self.head
+        while cur:
+            yield cur
+            cur = cur.next
+
+    def _link_after(self, node: Item, after: Optional[Item]):
+        # after=None means link at the head
+        node.prev = after
+        node.next = after.next if after else self.head
+        if node.next:
+            node.next.prev = node
+        else:
+            self.tail = node
+        if after:
+            after.next = node
+        else:
+            self.head = node
+
+    def _unlink(self, node: Item):
+        if node.prev:
+            node.prev.next = node.next
+        else:
+            self.head = node.next
+        if node.next:
+            node.next.prev = node.prev
+        else:
+            self.tail = node.prev
+        node.prev = None
+        node.next = None
+
+    def insert(self, node: Item) -> bool:
+        if node.item_id in self.index:
+            return False
+        if self.columnar:
+            node.item_id = sys.intern(node.item_id)
+            node.name = sys.intern(node.name)
+            node.slot = len(self.slots)
+            self.slots.append(node)
+            self.prices.append(node.price)
+            self.avail.append(1 if node.available else 0)
+        self._link_after(node, self.tail)
+        self.index[node.item_id] = node
+        return True
+
+    def delete(self, item_id: str) -> bool:
+        node = self.index.pop(item_id, None)
+        if not node:
+            return False
+        self._unlink(node)
+        if self.columnar:
+            # swap-remove: the last slot fills the hole
+            last = self.slots.pop()
+            self.prices.pop()
+            self.avail.pop()
+            if last is not node:
+                last.slot = node.slot
+                self.slots[node.slot] = last
+                self.prices[node.slot] = last.price
+                self.avail[node.slot] = 1 if last.available else 0
+            node.slot = -1
+        return True
+
+    def find(self, item_id: str) -> Optional[Item]:
+        return self.index.get(item_id)
+
+    def toggle(self, item_id: str, available: bool) -> Optional[Item]:
+        node = self.index.get(item_id)
+        if node:
+            node.available = available
+            if self.columnar:
+                self.avail[node.slot] = 1 if available else 0
+        return node
+
+    def set_price(self, item_id: str, price: float) -> Optional[Item]:
+        node = self.index.get(item_id)
+        if node:
+            node.price = price
+            if self.columnar:
+                self.prices[node.slot] = price
+        return node
+
+    def rename(self, item_id: str, name: str) -> Optional[Item]:
+        node = self.index.get(item_id)
+        if node:
+            node.name = sys.intern(name) if self.columnar else name
+        return node
+
+    def count_available(self) -> int:
+        if self.columnar:
+            return sum(self.avail)
+        return sum(1 for it in self if it.available)
+
+    def price_stats(self):
+        # (min, max, avg) or None for an empty menu
+        if not self.index:
+            return None
+        prices = self.prices if self.columnar else [it.price for it in self]
+        return min(prices), max(prices), sum(prices) / len(prices)
+
+    def move(self, item_id: str, after_id: Optional[str] = None) -> bool:
+        # reorder in place; after_id=None moves the item to the front
+        node = self.index.get(item_id)
+        if not node or item_id == after_id:
+            return False
+        after = None
+        if after_id is not None:
+            after = self.index.get(after_id)
+            if not after:
+                return False
+        self._unlink(node)
+        self._link_after(node, after)
+        return True
+
+    def to_list(self) -> List[Item]:
+        return list(self)
+
+    def page(self, cursor: Optional[str] = None, limit: int = 20):
+        # cursor is the item_id the page starts at (None = head); returns
+        # (items, next_cursor). a cursor whose item was deleted restarts at the head.
+        cur = self.index.get(cursor, self.head) if cursor is not None else self.head
+        out = []
+        while cur and len(out) < limit:
+            out.append(cur)
+            cur = cur.next
+        return out, cur.item_id if cur else None
+
+
+class Category:
+    def __init__(self, name: str, parent: Optional['Category'] = None, columnar: bool = False):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        # child names kept sorted on insert, so traversal never sorts
+        self.child_names = []
+        self.items_list = Menu(columnar)
+        # flattened [(node, depth)] for traverse_preorder, dropped on any tree change
+        self._preorder = None
+
+    def add_child(self, child_name: str):
+        if child_name not in self.children:
+            self.children[child_name] = Category(child_name, self, self.items_list.columnar)
+            bisect.insort(self.child_names, child_name)
+            self._invalidate()
+        return self.children[child_name]
+
+    def get_child(self, child_name: str) -> Optional['Category']:
+        return self.children.get(child_name)
+
+    def _invalidate(self):
+        node = self
+        while node:
+            node._preorder = None
+            node = node.parent
+
+    def traverse_preorder(self):
+        if self._preorder is None:
+            out = []
+            stack = [(self, 0)]
+            while stack:
+                node, depth = stack.pop()
+                out.append((node, depth))
+                for child_name in reversed(node.child_names):
+                    stack.append((node.children[child_name], depth+1))
+            self._preorder = out
+        return iter(self._preorder)
+
+
+class SearchIndex:
+    # inverted n-gram index (all 1..NGRAM grams) over shop and item names/ids.
+    # a query no longer than NGRAM is itself a gram, so its posting set is the
+    # exact answer; longer queries intersect their trigram postings and then
+    # verify the substring on the few survivors.
+    #
+    # docs map key -> (seq, lowercased fields). keys are ('shop', shop_id) or
+    # ('item', shop_id, item_id); the catalog turns them back into objects, so
+    # the index holds no references into the menus.
+    NGRAM = 3
+
+    def __init__(self):
+        self.postings = {}
+        self.docs = {}
+        self.seq = 0
+        # shared by every shop, so writers from different shop locks serialize here
+        self.lock = threading.RLock()
+        # after restore(): postings still in the snapshot, {gram: (start, count)}
+        # into base_postings (ordinals into base_keys). a gram moves into
+        # self.postings the first time anything reads or writes it
+        self.base_grams = {}
+        self.base_keys = []
+        self.base_postings = ()
+
+    @classmethod
+    def grams(cls, text: str):
+        out = set()
+        for n in range(1, cls.NGRAM + 1):
+            for i in range(len(text) - n + 1):
+                out.add(text[i:i+n])
+        return out
+
+    def _get(self, g: str):
+        # posting set for g or None (caller holds the lock)
+        keys = self.postings.get(g)
+        if keys is None and self.base_grams:
+            loc = self.base_grams.pop(g, None)
+            if loc:
+                start, count = loc
+                keys = self.postings[g] = set(map(self.base_keys.__getitem__, self.base_postings[start:start + count]))
+        return keys
+
+    def _add(self, key, fields):
+        fields = tuple(f.lower() for f in fields)
+        with self.lock:
+            self.seq += 1
+            self.docs[key] = (self.seq, fields)
+            for f in fields:
+                for g in self.grams(f):
+                    keys = self._get(g)
+                    if keys is None:
+                        keys = self.postings[g] = set()
+                    keys.add(key)
+
+    def _remove(self, key):
+        with self.lock:
+            doc = self.docs.pop(key, None)
+            if not doc:
+                return
+            # pulls in every base gram holding key, so none of them can bring it back later
+            for f in doc[1]:
+                for g in self.grams(f):
+                    keys = self._get(g)
+                    if keys:
+                        keys.discard(key)
+                        if not keys:
+                            del self.postings[g]
+
+    def add_shop(self, shop: 'Shop'):
+        with shop.lock:
+            self._add(('shop', shop.shop_id), (shop.name, shop.shop_id))
+            for cat, it in shop.items.values():
+                self.add_item(shop, cat, it)
+
+    def add_item(self, shop: 'Shop', cat: Category, it: Item):
+        self._add(('item', shop.shop_id, it.item_id), (it.name, it.item_id))
+
+    def remove_item(self, shop: 'Shop', item_id: str):
+        self._remove(('item', shop.shop_id, item_id))
+
+    # rank buckets for ranked(); fuzzy scores are FUZZY + (share of bigrams missed)
+    EXACT, PREFIX, SUBSTRING, FUZZY = range(4)
+    FUZZY_MIN_SHARE = 0.5
+
+    def _matches(self, q: str):
+        # keys whose name or id contains q (caller holds the lock)
+        if len(q) <= self.NGRAM:
+            return set(self._get(q) or ())
+        sets = [self._get(q[i:i+self.NGRAM]) for i in range(len(q) - self.NGRAM + 1)]
+        if not all(sets):
+            return set()
+        sets.sort(key=len)
+        candidates = set(sets[0]).intersection(*sets[1:])
+        return {k for k in candidates if any(q in f for f in self.docs[k][1])}
+
+    def search(self, query: str):
+        with self.lock:
+            return self._sorted(self._matches(query.lower()))
+
+    def _sorted(self, keys):
+        # keep catalog insertion order so results don't jump around between searches
+        return sorted(keys, key=lambda k: self.docs[k][0])
+
+    def _score(self, key, q: str) -> int:
+        name, ident = self.docs[key][1]
+        if q == ident:
+            return self.EXACT
+        if name.startswith(q) or ident.startswith(q):
+            return self.PREFIX
+        return self.SUBSTRING
+
+    def _fuzzy(self, q: str):
+        # typo fallback: docs sharing enough of the query's bigrams (bigrams
+        # survive a swapped or mistyped letter better than trigrams do)
+        grams = {q[i:i+2] for i in range(len(q) - 1)}
+        if len(grams) < 3:
+            return []
+        counts = Counter()
+        for g in grams:
+            counts.update(self._get(g) or ())
+        need = len(grams) * self.FUZZY_MIN_SHARE
+        return [(self.FUZZY + 1 - n / len(grams), self.docs[k][0], k) for k, n in counts.items() if n >= need]
+
+    @metrics.timed('search_index.ranked')
+    def ranked(self, query: str, limit: int):
+        # -> ([(key, score)], total matches); best first, only the top
+        # `limit` are ever sorted (bounded heap)
+        q = query.lower()
+        with self.lock:
+            keys = self._matches(q)
+            if keys:
+                scored = [(self._score(k, q), self.docs[k][0], k) for k in keys]
+            else:
+                scored = self._fuzzy(q)
+            top = heapq.nsmallest(limit, scored)
+            return [(k, score) for score, _, k in top], len(scored)
+
+    def export(self):
+        # plain copies of the index for catalog_snapshot, taken under the
+        # lock; pack() turns them into the snapshot layout without it
+        with self.lock:
+            return (dict(self.docs), {g: tuple(members) for g, members in self.postings.items()},
+                    dict(self.base_grams), self.base_keys, self.base_postings)
+
+    @staticmethod
+    def pack(state):
+        # export() -> (keys, [(seq, fields)] aligned with keys,
+        # {gram: (start, count)}, array of key ordinals); unread base grams
+        # are carried over without being pulled in
+        docs, live, base_grams, base_keys, base_postings = state
+        keys = list(docs)
+        ordinal = {k: i for i, k in enumerate(keys)}
+        postings = array('I')
+        grams = {}
+        for g, members in live.items():
+            grams[g] = (len(postings), len(members))
+            postings.extend(map(ordinal.__getitem__, members))
+        if base_grams:
+            # a removed key is never in an unread gram (see _remove). while
+            # no base key has moved, the stored ordinals are still right
+            remap = [ordinal.get(k, 0) for k in base_keys]
+            same = remap == list(range(len(remap)))
+            for g, (start, count) in base_grams.items():
+                grams[g] = (len(postings), count)
+                if same:
+                    postings.frombytes(base_postings[start:start + count].tobytes())
+                else:
+                    postings.extend(map(remap.__getitem__, base_postings[start:start + count]))
+        return keys, list(docs.values()), grams, postings
+
+    def restore(self, keys, docs, grams, postings):
+        # install an index laid out by pack(); postings is an 'I' array or
+        # memoryview of ordinals (e.g. over the mapped snapshot file)
+        with self.lock:
+            self.docs = dict(zip(keys, docs))
+            self.seq = max((d[0] for d in docs), default=0)
+            self.postings = {}
+            self.base_keys = keys
+            self.base_grams = grams
+            self.base_postings = postings
+
+
+class ItemQueryIndex:
+    # structured item queries across every shop. each item gets an integer doc
+    # id; by_price is a sorted [(price, doc)] list for range scans, and the
+    # filters are int bitsets over doc ids (available, per shop, per shop
+    # status, per category name) so combining filters is a handful of C-level
+    # AND/ORs rather than a pass over the catalog. docs hold
+    # (shop_id, category name, item_id, price); the catalog resolves them.
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.next_doc = 0
+        self.docs = {}
+        self.doc_of = {}
+        self.by_price = []
+        self.available = 0
+        self.all = 0
+        self.shop_bits = {}
+        self.status_bits = {}
+        self.category_bits = {}
+
+    def add_item(self, shop: 'Shop', cat: Category, it: Item):
+        with self.lock:
+            doc = self.next_doc
+            self.next_doc += 1
+            bit = 1 << doc
+            self.docs[doc] = (shop.shop_id, cat.name, it.item_id, it.price)
+            self.doc_of[(shop.shop_id, it.item_id)] = doc
+            bisect.insort(self.by_price, (it.price, doc))
+            self.all |= bit
+            if it.available:
+                self.available |= bit
+            self.shop_bits[shop.shop_id] = self.shop_bits.get(shop.shop_id, 0) | bit
+            self.status_bits[shop.status] = self.status_bits.get(shop.status, 0) | bit
+            self.category_bits[cat.name] = self.category_bits.get(cat.name, 0) | bit
+
+    def add_shop(self, shop: 'Shop'):
+        with shop.lock:
+            for cat, it in shop.items.values():
+                self.add_item(shop, cat, it)
+
+    def remove_item(self, shop: 'Shop', item_id: str):
+        with self.lock:
+            doc = self.doc_of.pop((shop.shop_id, item_id), None)
+            if doc is None:
+                return
+            _, category_name, _, price = self.docs.pop(doc)
+            self._unprice(price, doc)
+            keep = ~(1 << doc)
+            self.all &= keep
+            self.available &= keep
+            self.shop_bits[shop.shop_id] &= keep
+            self.status_bits[shop.status] = self.status_bits.get(shop.status, 0) & keep
+            self.category_bits[category_name] &= keep
+
+    def _unprice(self, price: float, doc: int):
+        i = bisect.bisect_left(self.by_price, (price, doc))
+        if i < len(self.by_price) and self.by_price[i] == (price, doc):
+            del self.by_price[i]
+
+    def update_item(self, shop: 'Shop', it: Item, old_price: Optional[float] = None):
+        # re-read availability (and price, when old_price says it moved)
+        with self.lock:
+            doc = self.doc_of.get((shop.shop_id, it.item_id))
+            if doc is None:
+                return
+            bit = 1 << doc
+            if it.available:
+                self.available |= bit
+            else:
+                self.available &= ~bit
+            if old_price is not None and old_price != it.price:
+                self._unprice(old_price, doc)
+                bisect.insort(self.by_price, (it.price, doc))
+                self.docs[doc] = self.docs[doc][:3] + (it.price,)
+
+    def shop_items(self, shop_id: str):
+        # -> {item_id: (category name, price, available)} as indexed
+        with self.lock:
+            bits = self.shop_bits.get(shop_id, 0)
+            available = self.available & bits
+            out = {}
+            while bits:
+                low = bits & -bits
+                bits ^= low
+                _, category_name, item_id, price = self.docs[low.bit_length() - 1]
+                out[item_id] = (category_name, price, bool(available & low))
+            return out
+
+    def status_changed(self, shop: 'Shop', old_status: str):
+        with self.lock:
+            bits = self.shop_bits.get(shop.shop_id, 0)
+            self.status_bits[old_status] = self.status_bits.get(old_status, 0) & ~bits
+            self.status_bits[shop.status] = self.status_bits.get(shop.status, 0) | bits
+
+    STATE = ('next_doc', 'docs', 'doc_of', 'by_price', 'available', 'all', 'shop_bits', 'status_bits', 'category_bits')
+
+    def export(self):
+        # plain containers only (shallow copies), for catalog_snapshot
+        with self.lock:
+            state = {name: getattr(self, name) for name in self.STATE}
+            return {name: v.copy() if isinstance(v, (dict, list)) else v for name, v in state.items()}
+
+    def restore(self, state: dict):
+        with self.lock:
+            for name in self.STATE:
+                setattr(self, name, state[name])
+
+    def categories(self) -> List[str]:
+        return sorted(name for name, bits in self.category_bits.items() if bits)
+
+    @metrics.timed('query_index.query')
+    def query(self, min_price: Optional[float] = None, max_price: Optional[float] = None,
+              available: Optional[bool] = None, status: Optional[str] = None,
+              category: Optional[str] = None, shop_id: Optional[str] = None,
+              descending: bool = False, offset: int = 0, limit: int = 20):
+        # -> ([(shop_id, category name, item_id, price)], next_offset or None), ordered by price
+        with self.lock:
+            mask = self.all
+            if available is not None:
+                mask &= self.available if available else ~self.available
+            if status is not None:
+                mask &= self.status_bits.get(status, 0)
+            if category is not None:
+                mask &= self.category_bits.get(category, 0)
+            if shop_id is not None:
+                mask &= self.shop_bits.get(shop_id, 0)
+            lo = 0 if min_price is None else bisect.bisect_left(self.by_price, (min_price, -1))
+            hi = len(self.by_price) if max_price is None else bisect.bisect_right(self.by_price, (max_price, self.next_doc))
+            if not mask or lo >= hi:
+                return [], None
+            # one conversion, then O(1) byte lookups while walking the price range
+            bits = mask.to_bytes((self.next_doc >> 3) + 1, 'little')
+            rng = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+            out = []
+            skipped = 0
+            for i in rng:
+                doc = self.by_price[i][1]
+                if not bits[doc >> 3] >> (doc & 7) & 1:
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                if len(out) == limit:
+                    return out, offset + limit
+                out.append(self.docs[doc])
+            return out, None
+
+
+class ShopDirectory:
+    # typeahead over shop ids and names: sorted (term, shop_id) lists, so a
+    # prefix is one bisect plus a walk over just the matching range. ids and
+    # names are kept apart so id matches rank first; a name is indexed whole
+    # and from each word, so "gri" finds "Tito Jims Grill". added terms are
+    # appended and sorted on the next lookup, which keeps bulk loads linear
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = []
+        self.names = []
+        self.dirty = False
+
+    def add(self, shop_id: str, name: str):
+        name = name.lower()
+        with self.lock:
+            self.ids.append((shop_id.lower(), shop_id))
+            self.names.append((name, shop_id))
+            self.names.extend((word, shop_id) for word in set(name.split()[1:]))
+            self.dirty = True
+
+    def match(self, prefix: str, limit: int = 10) -> List[str]:
+        # -> up to limit shop ids: id prefix matches, then name matches
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        out = []
+        with self.lock:
+            if self.dirty:
+                self.ids.sort()
+                self.names.sort()
+                self.dirty = False
+            for terms in (self.ids, self.names):
+                i = bisect.bisect_left(terms, (prefix,))
+                while i < len(terms) and len(out) < limit and terms[i][0].startswith(prefix):
+                    if terms[i][1] not in out:
+                        out.append(terms[i][1])
+                    i += 1
+        return out
+
+
+RECENT_LIMIT = 5
+SEARCH_CACHE_SIZE = 256
+CHANGE_RETENTION = 1000
+# seconds between Catalog.sync() checks for writes from other processes
+SYNC_INTERVAL = 1.0
+# past this many differing items, a sync rebuilds the menu instead of replaying rows
+SYNC_REPLAY_LIMIT = 20
+# orders a shop's queue holds before place() pushes back (see OrderQueue)
+ORDER_QUEUE_LIMIT = 50
+# prep time estimate: a fixed part per order plus a part per unit ordered, in seconds
+ORDER_BASE_PREP = 120
+ORDER_ITEM_PREP = 60
+# completed orders kept per shop so customers can still look theirs up
+ORDERS_DONE_KEEP = 100
+# write-through target while a shop replays stored rows (see Shop._writes)
+NO_WRITES = Storage()
+
+# one structured change. kind is e.g. 'item_added', data holds the ids and
+# values involved, text is the human-readable line the update panels show
+Change = namedtuple('Change', 'seq at kind data text')
+
+
+class ChangeLog:
+    # append-only, sequence-numbered log of a shop's changes. only the last
+    # `retention` events are kept; seq keeps counting regardless, and the
+    # owning shop's version is simply the last seq.
+    def __init__(self, retention=CHANGE_RETENTION):
+        self.events = deque(maxlen=retention)
+        self.seq = 0
+
+    def append(self, kind: str, text: str, **data) -> Change:
+        self.seq += 1
+        event = Change(self.seq, time.time(), kind, data, text)
+        self.events.append(event)
+        return event
+
+    def since(self, seq: int):
+        # -> (events after seq, complete). complete is False when retention
+        # already dropped some of them and the reader has to reload full state.
+        # seqs in the deque are contiguous, so the start is plain arithmetic
+        if seq >= self.seq or not self.events:
+            return [], True
+        first = self.events[0].seq
+        return list(islice(self.events, max(seq + 1 - first, 0), None)), seq + 1 >= first
+
+    def recent(self, limit=RECENT_LIMIT) -> List[str]:
+        # the old "Recent Updates" view, oldest first
+        n = len(self.events)
+        return [self.events[i].text for i in range(max(0, n - limit), n)]
+
+
+SHOP_STATUSES = ['Open', 'Closed', 'Preparing']
+
+# immutable read views published by Shop after every change. readers take
+# shop.snapshot (a single attribute read) and never need the shop lock.
+ItemView = namedtuple('ItemView', 'item_id name price available')
+# items: tuple of ItemView in menu order; index: item_id -> ItemView
+CategoryView = namedtuple('CategoryView', 'name depth items index')
+# categories: CategoryView tuple in preorder (root excluded); cats: name -> CategoryView
+ShopSnapshot = namedtuple('ShopSnapshot', 'shop_id name status version categories cats')
+# what the shop list shows; published even while the menu is not loaded
+ShopSummary = namedtuple('ShopSummary', 'shop_id name status version')
+
+
+class StaleVersionError(Exception):
+    # raised when a write was prepared against an older version of the shop
+    def __init__(self, shop_id: str, expected: int, actual: int):
+        super().__init__(f"shop {shop_id} is at version {actual}, not {expected}")
+        self.shop_id = shop_id
+        self.expected = expected
+        self.actual = actual
+
+
+class QueueFullError(Exception):
+    # backpressure: the shop already has as many orders waiting as it takes
+    def __init__(self, shop_id: str, limit: int):
+        super().__init__(f"shop {shop_id} already has {limit} orders waiting")
+        self.shop_id = shop_id
+        self.limit = limit
+
+
+class Order:
+    __slots__ = ('order_id', 'seq', 'customer', 'lines', 'total', 'prep_seconds',
+                 'placed_at', 'started_at', 'completed_at', 'status')
+
+    def __init__(self, order_id: str, customer: str, lines, prep_seconds: float, seq: int = 0):
+        self.order_id = order_id
+        # number within the shop, as stored (see Storage.add_order)
+        self.seq = seq
+        self.customer = customer
+        # ((item_id, name, quantity, unit price), ...) as they were when placed
+        self.lines = lines
+        self.total = sum(qty * price for _, _, qty, price in lines)
+        self.prep_seconds = prep_seconds
+        self.placed_at = time.time()
+        self.started_at = None
+        self.completed_at = None
+        # waiting -> preparing -> done
+        self.status = 'waiting'
+
+    @property
+    def due(self) -> float:
+        # when it would be ready if started on arrival; the queue's sort key
+        return self.placed_at + self.prep_seconds
+
+
+class OrderQueue:
+    # a shop's incoming orders. waiting orders sit in a heap keyed by arrival
+    # plus estimated prep time, so a quick order placed just after a big one
+    # goes first, while an order can only be overtaken by ones that would be
+    # done sooner. at most `limit` orders wait; past that place() raises
+    # QueueFullError. the queue has its own lock and is written through to
+    # storage, so other processes and restarts see the same orders (see
+    # restore). placing an order reads the shop's menu, which loads it first
+    # if it was evicted; otherwise no shop or catalog lock is taken
+    def __init__(self, shop: 'Shop', limit: int = ORDER_QUEUE_LIMIT):
+        self.shop = shop
+        self.limit = limit
+        self.lock = threading.Lock()
+        # heap of (due, seq, Order)
+        self.waiting = []
+        # order_id -> Order, in the order they were started
+        self.preparing = {}
+        self.done = deque()
+        # every order still tracked (waiting, preparing or recently done)
+        self.by_id = {}
+        self.seq = 0
+        # moves on every place, pop and complete; pages showing orders watch it
+        self.version = 0
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def place(self, customer: str, quantities) -> Order:
+        # quantities: {item_id: quantity}. every item must be available right
+        # now; name and price are copied into the order
+        lines = []
+        for item_id, qty in quantities.items():
+            _, it = self.shop.find_item(item_id)
+            if not it or not it.available:
+                raise ValueError(f"{it.name if it else item_id} is not available")
+            if qty > 0:
+                lines.append((item_id, it.name, qty, it.price))
+        if not lines:
+            raise ValueError("The order is empty")
+        prep = ORDER_BASE_PREP + ORDER_ITEM_PREP * sum(qty for _, _, qty, _ in lines)
+        with self.lock:
+            if len(self.waiting) >= self.limit:
+                metrics.count('orders.rejected')
+                raise QueueFullError(self.shop.shop_id, self.limit)
+            order = Order(None, customer, tuple(lines), prep)
+            # storage numbers orders per shop across every process sharing it
+            storage = self.shop.storage
+            seq = storage.add_order(self.shop.shop_id, order)
+            if not seq and storage.durable:
+                raise RuntimeError(f"storage did not record the order for shop {self.shop.shop_id}")
+            self.seq = seq or self.seq + 1
+            order.seq = self.seq
+            order.order_id = f"{self.shop.shop_id}-{self.seq}"
+            heapq.heappush(self.waiting, (order.due, self.seq, order))
+            self.by_id[order.order_id] = order
+            self.version += 1
+        metrics.count('orders.placed')
+        return order
+
+    def pop(self, n: int = 1) -> List[Order]:
+        # start preparing up to n orders, most urgent first
+        now = time.time()
+        with self.lock:
+            taken = [heapq.heappop(self.waiting)[2] for _ in range(min(n, len(self.waiting)))]
+            # orders another process started first come back as preparing on the next sync
+            ok = set(self.shop.storage.start_orders(self.shop.shop_id, [o.seq for o in taken], now)) if taken else ()
+            started = [order for order in taken if order.seq in ok]
+            for order in started:
+                order.status = 'preparing'
+                order.started_at = now
+                self.preparing[order.order_id] = order
+            if started:
+                self.version += 1
+        for order in started:
+            metrics.observe('orders.wait', now - order.placed_at)
+        return started
+
+    def complete(self, order_ids) -> List[Order]:
+        # mark preparing orders done; ids that aren't preparing are skipped
+        now = time.time()
+        completed = []
+        with self.lock:
+            for order_id in order_ids:
+                order = self.preparing.pop(order_id, None)
+                if order is None:
+                    continue
+                order.status = 'done'
+                order.completed_at = now
+                self.done.append(order)
+                completed.append(order)
+            if completed:
+                self.shop.storage.complete_orders(self.shop.shop_id, [o.seq for o in completed], now)
+                self.version += 1
+            while len(self.done) > ORDERS_DONE_KEEP:
+                del self.by_id[self.done.popleft().order_id]
+        for order in completed:
+            metrics.observe('orders.prep', now - order.started_at)
+            metrics.observe('orders.turnaround', now - order.placed_at)
+        if completed:
+            metrics.count('orders.completed', len(completed))
+        return completed
+
+    def restore(self, rows):
+        # replace the queue with stored order rows (see Storage.load_orders)
+        with self.lock:
+            self._restore(rows)
+
+    def reload(self):
+        # re-read after another process placed, started or finished orders.
+        # read under the lock, so an order placed here meanwhile isn't lost
+        with self.lock:
+            self._restore(self.shop.storage.load_shop_orders(self.shop.shop_id, ORDERS_DONE_KEEP))
+
+    def _restore(self, rows):
+        waiting, preparing, done, by_id = [], [], [], {}
+        for seq, customer, lines, prep, placed_at, started_at, completed_at, status in rows:
+            order = Order(f"{self.shop.shop_id}-{seq}", customer, lines, prep, seq)
+            order.placed_at, order.started_at, order.completed_at, order.status = placed_at, started_at, completed_at, status
+            by_id[order.order_id] = order
+            if status == 'waiting':
+                waiting.append((order.due, seq, order))
+            elif status == 'preparing':
+                preparing.append(order)
+            else:
+                done.append(order)
+        heapq.heapify(waiting)
+        preparing.sort(key=lambda o: o.started_at)
+        done.sort(key=lambda o: o.completed_at)
+        self.waiting = waiting
+        self.preparing = {order.order_id: order for order in preparing}
+        self.done = deque(done)
+        self.by_id = by_id
+        self.seq = max(self.seq, max((row[0] for row in rows), default=0))
+        self.version += 1
+
+    def get(self, order_id: str) -> Optional[Order]:
+        return self.by_id.get(order_id)
+
+    def waiting_orders(self) -> List[Order]:
+        # in the order pop() would take them
+        with self.lock:
+            return [order for _, _, order in sorted(self.waiting)]
+
+    def preparing_orders(self) -> List[Order]:
+        with self.lock:
+            return list(self.preparing.values())
+
+    def stats(self) -> dict:
+        with self.lock:
+            oldest = min((order.placed_at for _, _, order in self.waiting), default=None)
+            return {'waiting': len(self.waiting), 'preparing': len(self.preparing), 'limit': self.limit,
+                    'oldest_wait': time.time() - oldest if oldest else 0.0}
+
+
+class ShopMenu:
+    # the part of a Shop that can be dropped and rebuilt (see Shop.evict)
+    __slots__ = ('tree', 'items', 'views', 'dirty', 'snapshot')
+
+    def __init__(self, tree: Category):
+        self.tree = tree
+        # item_id -> (Category, Item), item ids are unique across the whole shop
+        self.items = {}
+        # category views are copy-on-write: only dirty categories are rebuilt on publish
+        self.views = {}
+        self.dirty = set()
+        self.snapshot = None
+
+
+class Shop:
+    # the summary (ids, name, status, change log) is always in memory; the
+    # menu is built on first use, from `source` (e.g. a catalog snapshot) or
+    # else from storage, and the catalog may evict it again when it goes cold
+    def __init__(self, shop_id: str, name: str, password: str, columnar: bool = False,
+                 status: str = "Closed"):
+        self.shop_id = shop_id
+        self.name = name
+        self.password = password
+        self.status = status
+        self.columnar = columnar
+        self.changes = ChangeLog()
+        self.orders = OrderQueue(self)
+        self.catalog: Optional['Catalog'] = None
+        self.storage = Storage()
+        # set while apply_stored replays rows that are already stored
+        self.replaying = False
+        # writers hold the lock; every successful change appends to self.changes
+        # and publishes a new self.summary (and snapshot, while the menu is loaded)
+        self.lock = threading.RLock()
+        # callable -> (categories, items) rows as stored; dropped on any change
+        self.source = None
+        self._menu = self._build([], [])
+        self.summary = self._summarize()
+
+    @property
+    def version(self) -> int:
+        return self.changes.seq
+
+    @property
+    def menu_tree(self) -> Category:
+        return self._loaded().tree
+
+    @property
+    def items(self):
+        return self._loaded().items
+
+    @property
+    def snapshot(self) -> ShopSnapshot:
+        return self._loaded().snapshot
+
+    @property
+    def evictable(self) -> bool:
+        # only if the menu can be rebuilt exactly as it is now
+        return self.source is not None or self.storage.durable
+
+    def _loaded(self) -> ShopMenu:
+        # no bookkeeping here: this runs on every menu read, so uses are
+        # counted once per page or request instead (Catalog.use)
+        menu = self._menu
+        if menu is not None:
+            return menu
+        with self.lock:
+            if self._menu is None:
+                self._menu = self._build(*self.menu_rows())
+                if self.catalog:
+                    self.catalog.menus.loaded(self, len(self._menu.items), miss=True)
+            return self._menu
+
+    def _build(self, categories, items) -> ShopMenu:
+        menu = ShopMenu(Category(self.name, columnar=self.columnar))
+        for category_name in categories:
+            menu.tree.add_child(category_name)
+        for category_name, item_id, item_name, price, available in items:
+            cat = menu.tree.add_child(category_name)
+            node = Item(item_id, item_name, price, available)
+            if cat.items_list.insert(node):
+                menu.items[item_id] = (cat, node)
+        menu.snapshot = self._publish(menu)
+        return menu
+
+    def menu_rows(self):
+        # (categories, items) in storage's row shape, without loading the menu
+        menu = self._menu
+        if menu is not None:
+            return (list(menu.tree.children),
+                    [(name, it.item_id, it.name, it.price, it.available)
+                     for name, cat in menu.tree.children.items() for it in cat.items_list])
+        if self.source:
+            return self.source()
+        return self._stored_rows()
+
+    def _stored_rows(self):
+        stored = self.storage.load_shop(self.shop_id)
+        return stored[1:] if stored else ([], [])
+
+    def menu_reader(self):
+        # -> callable returning menu_rows() as of now; caller holds the lock.
+        # only a loaded menu is copied here, an unloaded one is read when
+        # called (its source never changes; storage only moves forward)
+        if self._menu is not None:
+            rows = self.menu_rows()
+            return lambda: rows
+        return self.source or self._stored_rows
+
+    def set_source(self, source):
+        # start unloaded; the menu is built from source() when first used
+        with self.lock:
+            self.source = source
+            self._menu = None
+
+    def evict(self) -> bool:
+        # drop the menu if nobody is using the shop right now
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self._menu is None or not self.evictable:
+                return False
+            self._menu = None
+            if self.catalog:
+                self.catalog.menus.dropped(self)
+            return True
+        finally:
+            self.lock.release()
+
+    @property
+    def _writes(self) -> Storage:
+        # where the mutators write through. only the lock holder mutates, so
+        # a replay turns write-through off for itself alone; everyone else
+        # (orders, evicted-menu reads) keeps using self.storage
+        return NO_WRITES if self.replaying else self.storage
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.shop_id}-{self.version}"'
+
+    def _check(self, expected_version: Optional[int]):
+        if expected_version is not None and expected_version != self.version:
+            raise StaleVersionError(self.shop_id, expected_version, self.version)
+
+    def _summarize(self) -> ShopSummary:
+        return ShopSummary(self.shop_id, self.name, self.status, self.version)
+
+    @metrics.timed('shop.publish')
+    def _publish(self, menu: ShopMenu) -> ShopSnapshot:
+        views = {}
+        for node, depth in menu.tree.traverse_preorder():
+            if node is menu.tree:
+                continue
+            view = menu.views.get(node)
+            if view is None or node in menu.dirty:
+                items = tuple(ItemView(it.item_id, it.name, it.price, it.available) for it in node.items_list)
+                view = CategoryView(node.name, depth, items, MappingProxyType({v.item_id: v for v in items}))
+            views[node] = view
+        menu.views = views
+        menu.dirty.clear()
+        categories = tuple(views.values())
+        return ShopSnapshot(self.shop_id, self.name, self.status, self.version, categories,
+                            MappingProxyType({v.name: v for v in categories}))
+
+    def _changed(self, kind: str, text: str, listing: bool = False, **data):
+        self.changes.append(kind, text, **data)
+        self.source = None
+        self.summary = self._summarize()
+        menu = self._menu
+        if menu is not None:
+            menu.snapshot = self._publish(menu)
+        if self.catalog:
+            if menu is not None:
+                self.catalog.menus.loaded(self, len(menu.items))
+            self.catalog.shop_changed(self, listing)
+
+    def set_status(self, status: str, expected_version: Optional[int] = None) -> bool:
+        with self.lock:
+            self._check(expected_version)
+            if status == self.status:
+                return False
+            old_status = self.status
+            self.status = status
+            self._writes.set_status(self.shop_id, status)
+            if self.catalog:
+                self.catalog.status_changed(self, old_status)
+            self._changed('status_changed', f"Shop status changed to {status}", listing=True, status=status, old_status=old_status)
+            return True
+
+    def add_category(self, category_name: str, expected_version: Optional[int] = None):
+        with self.lock:
+            self._check(expected_version)
+            self._loaded().tree.add_child(category_name)
+            self._writes.add_category(self.shop_id, category_name)
+            self._changed('category_added', f"Category '{category_name}' added", category=category_name)
+
+    def add_item(self, category_name: str, item_id: str, item_name: str, price: float,
+                 expected_version: Optional[int] = None) -> bool:
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            if item_id in menu.items:
+                return False
+            # stored first: another process may have taken the id since the last sync
+            if not self._writes.add_item(self.shop_id, category_name, item_id, item_name, price, True):
+                return False
+            cat = menu.tree.get_child(category_name)
+            if not cat:
+                cat = menu.tree.add_child(category_name)
+            node = Item(item_id, item_name, price, available=True)
+            cat.items_list.insert(node)
+            menu.items[item_id] = (cat, node)
+            menu.dirty.add(cat)
+            if self.catalog:
+                self.catalog.item_added(self, cat, node)
+            self._changed('item_added', f"Added item '{item_name}' to {category_name}",
+                          category=category_name, item_id=item_id, name=item_name, price=price)
+            return True
+
+    @metrics.timed('shop.bulk_add')
+    def bulk_add(self, rows) -> int:
+        # rows: (category, item_id, name, price, available). one lock hold, one
+        # storage transaction, one version bump and one update entry for the
+        # whole batch. ids already in the shop are skipped; returns how many were added
+        with self.lock:
+            menu = self._loaded()
+            # stored first, keeping only the ids nobody (here or elsewhere) has yet
+            fresh = {}
+            for row in rows:
+                if row[1] not in menu.items:
+                    fresh.setdefault(row[1], row)
+            rows = self._writes.add_items(self.shop_id, list(fresh.values())) if fresh else []
+            added = []
+            categories = set()
+            for category_name, item_id, item_name, price, available in rows:
+                cat = menu.tree.add_child(category_name)
+                node = Item(item_id, item_name, price, available)
+                cat.items_list.insert(node)
+                menu.items[item_id] = (cat, node)
+                menu.dirty.add(cat)
+                if self.catalog:
+                    self.catalog.item_added(self, cat, node)
+                added.append((category_name, item_id, item_name, price, available))
+                categories.add(category_name)
+            if added:
+                self._changed('items_imported',
+                              f"Imported {len(added)} item(s) into {len(categories)} categor{'y' if len(categories) == 1 else 'ies'}",
+                              categories=sorted(categories), item_ids=[r[1] for r in added])
+            return len(added)
+
+    def remove_item(self, category_name: str, item_id: str, expected_version: Optional[int] = None):
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            cat, _ = menu.items.get(item_id, (None, None))
+            if not cat or cat.name != category_name:
+                return False
+            success = cat.items_list.delete(item_id)
+            if success:
+                del menu.items[item_id]
+                menu.dirty.add(cat)
+                self._writes.remove_item(self.shop_id, item_id)
+                if self.catalog:
+                    self.catalog.item_removed(self, item_id)
+                self._changed('item_removed', f"Removed item {item_id} from {category_name}",
+                              category=category_name, item_id=item_id)
+            return success
+
+    def move_item(self, category_name: str, item_id: str, after_id: Optional[str] = None,
+                  expected_version: Optional[int] = None):
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            cat, _ = menu.items.get(item_id, (None, None))
+            if not cat or cat.name != category_name:
+                return False
+            success = cat.items_list.move(item_id, after_id)
+            if success:
+                menu.dirty.add(cat)
+                self._writes.reorder(self.shop_id, category_name, [it.item_id for it in cat.items_list])
+                self._changed('item_moved', f"Moved item {item_id} in {category_name}",
+                              category=category_name, item_id=item_id, after_id=after_id)
+            return success
+
+    def restore(self, categories, items):
+        # rebuild from stored rows without logging, versioning or writing back
+        with self.lock:
+            self._menu = self._build(categories, items)
+
+    def apply_stored(self, status: str, categories, items) -> int:
+        # bring this shop in line with rows another process wrote. small diffs
+        # go through the normal mutators (so indexes, snapshot and change log
+        # follow) with write-through switched off, since the rows are already
+        # stored. a bigger diff (a bulk import, a batch edit) would log and
+        # republish once per row, so the menu is rebuilt from the rows instead
+        # and the number of items that differed is returned: the caller then
+        # reindexes and logs one entry. an unloaded menu is simply left to be
+        # rebuilt from storage
+        with self.lock:
+            self.replaying = True
+            try:
+                if status != self.status:
+                    self.set_status(status)
+                if self._menu is None:
+                    return 0
+                differing = len({row[1] for row in set(self.menu_rows()[1]).symmetric_difference(items)})
+                if differing > SYNC_REPLAY_LIMIT:
+                    self._menu = self._build(categories, items)
+                    if self.catalog:
+                        self.catalog.menus.loaded(self, len(self._menu.items))
+                    return differing
+                for category_name in categories:
+                    if category_name not in self.menu_tree.children:
+                        self.add_category(category_name)
+                stored = {row[1]: row for row in items}
+                for item_id, (cat, _) in list(self.items.items()):
+                    row = stored.get(item_id)
+                    if not row or row[0] != cat.name:
+                        self.remove_item(cat.name, item_id)
+                for category_name, item_id, item_name, price, available in items:
+                    if item_id not in self.items:
+                        self.add_item(category_name, item_id, item_name, price)
+                    _, it = self.items[item_id]
+                    if it.available != available:
+                        self.toggle_availability(category_name, item_id, available)
+                    if it.price != price:
+                        self.set_price(category_name, item_id, price)
+                    if it.name != item_name:
+                        self.rename_item(category_name, item_id, item_name)
+                # stored rows come grouped by category in menu order
+                order = {}
+                for category_name, item_id, *_ in items:
+                    order.setdefault(category_name, []).append(item_id)
+                for category_name, ids in order.items():
+                    menu = self.menu_tree.children[category_name].items_list
+                    if [it.item_id for it in menu] != ids:
+                        prev = None
+                        for item_id in ids:
+                            menu.move(item_id, prev)
+                            prev = item_id
+                        self._menu.dirty.add(self.menu_tree.children[category_name])
+                        self._changed('item_moved', f"Menu order updated in {category_name}", category=category_name)
+                return 0
+            finally:
+                self.replaying = False
+                self.source = None
+
+    def find_item(self, item_id: str):
+        return self.items.get(item_id, (None, None))
+
+    def changes_since(self, seq: int):
+        # see ChangeLog.since; under the lock so the log can't move mid-read
+        with self.lock:
+            return self.changes.since(seq)
+
+    def category_stats(self):
+        # {category: (items, available, price_stats)}
+        return {name: (len(cat.items_list), cat.items_list.count_available(), cat.items_list.price_stats())
+                for name, cat in self.menu_tree.children.items()}
+
+    def sold_out_ratio(self) -> float:
+        total = available = 0
+        for cat, _ in self.menu_tree.traverse_preorder():
+            total += len(cat.items_list)
+            available += cat.items_list.count_available()
+        return (total - available) / total if total else 0.0
+
+    def toggle_availability(self, category_name: str, item_id: str, available: bool,
+                            expected_version: Optional[int] = None):
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            cat, found = menu.items.get(item_id, (None, None))
+            if not cat or cat.name != category_name:
+                return False
+            cat.items_list.toggle(item_id, available)
+            menu.dirty.add(cat)
+            self._writes.set_available(self.shop_id, item_id, available)
+            if self.catalog:
+                self.catalog.item_updated(self, found)
+            state = "Available" if available else "Sold Out"
+            self._changed('item_toggled', f"Item '{found.name}' marked {state}",
+                          category=category_name, item_id=item_id, available=available)
+            return True
+
+    def set_price(self, category_name: str, item_id: str, price: float,
+                  expected_version: Optional[int] = None):
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            cat, found = menu.items.get(item_id, (None, None))
+            if not cat or cat.name != category_name:
+                return False
+            old_price = found.price
+            cat.items_list.set_price(item_id, price)
+            menu.dirty.add(cat)
+            self._writes.set_price(self.shop_id, item_id, price)
+            if self.catalog:
+                self.catalog.item_updated(self, found, old_price)
+            self._changed('item_repriced', f"Item '{found.name}' now ₱{price:.2f}",
+                          category=category_name, item_id=item_id, price=price, old_price=old_price)
+            return True
+
+    def rename_item(self, category_name: str, item_id: str, item_name: str,
+                    expected_version: Optional[int] = None):
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            cat, found = menu.items.get(item_id, (None, None))
+            if not cat or cat.name != category_name:
+                return False
+            old_name = found.name
+            cat.items_list.rename(item_id, item_name)
+            menu.dirty.add(cat)
+            self._writes.set_name(self.shop_id, item_id, item_name)
+            if self.catalog:
+                self.catalog.item_renamed(self, cat, found)
+            self._changed('item_renamed', f"Item '{old_name}' renamed to '{item_name}'",
+                          category=category_name, item_id=item_id, name=item_name)
+            return True
+
+    def edit_items(self, rows, expected_version: Optional[int] = None) -> int:
+        # rows: (item_id, name, price, available, remove) as the vendor wants
+        # them, e.g. from the batch editor. diffed against the menu and applied
+        # under one lock hold and one storage transaction, with one version
+        # bump and one update entry; unchanged and unknown items are skipped.
+        # returns how many items changed
+        with self.lock:
+            self._check(expected_version)
+            menu = self._loaded()
+            counts = Counter()
+            edited = []
+            with self._writes.batch():
+                for item_id, item_name, price, available, remove in rows:
+                    cat, it = menu.items.get(item_id, (None, None))
+                    if not it:
+                        continue
+                    if remove:
+                        cat.items_list.delete(item_id)
+                        del menu.items[item_id]
+                        menu.dirty.add(cat)
+                        self._writes.remove_item(self.shop_id, item_id)
+                        if self.catalog:
+                            self.catalog.item_removed(self, item_id)
+                        counts['removed'] += 1
+                        edited.append(item_id)
+                        continue
+                    if (item_name, price, available) == (it.name, it.price, it.available):
+                        continue
+                    if item_name != it.name:
+                        cat.items_list.rename(item_id, item_name)
+                        self._writes.set_name(self.shop_id, item_id, item_name)
+                        if self.catalog:
+                            self.catalog.item_renamed(self, cat, it)
+                        counts['renamed'] += 1
+                    old_price = it.price
+                    if price != old_price:
+                        cat.items_list.set_price(item_id, price)
+                        self._writes.set_price(self.shop_id, item_id, price)
+                        counts['repriced'] += 1
+                    if available != it.available:
+                        cat.items_list.toggle(item_id, available)
+                        self._writes.set_available(self.shop_id, item_id, available)
+                        counts['marked available' if available else 'marked sold out'] += 1
+                    menu.dirty.add(cat)
+                    if self.catalog:
+                        self.catalog.item_updated(self, it, old_price)
+                    edited.append(item_id)
+            if edited:
+                self._changed('items_edited',
+                              f"Edited {len(edited)} item(s): " + ', '.join(f"{n} {what}" for what, n in counts.items()),
+                              item_ids=edited, counts=dict(counts))
+            return len(edited)
+
+
+class MenuCache:
+    # LRU over the shops whose menu is in memory, bounded by their total item
+    # count (budget None = unbounded). Shop reports loads, Catalog.use reports
+    # uses of a resident menu; when a load
+    # goes over budget the coldest menus are evicted, skipping shops that are
+    # busy or can't rebuild their menu (Shop.evictable)
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.lock = threading.Lock()
+        # shop_id -> (shop, items), coldest first
+        self.lru = OrderedDict()
+        self.items = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def hit(self, shop: 'Shop'):
+        # a use of a menu already in memory; a cold one is counted as a miss
+        # when it loads
+        with self.lock:
+            if shop.shop_id in self.lru:
+                self.hits += 1
+                self.lru.move_to_end(shop.shop_id)
+
+    def loaded(self, shop: 'Shop', items: int, miss: bool = False):
+        # shop's menu is in memory with this many items (called under shop.lock)
+        with self.lock:
+            if miss:
+                self.misses += 1
+            old = self.lru.pop(shop.shop_id, None)
+            self.items += items - (old[1] if old else 0)
+            self.lru[shop.shop_id] = (shop, items)
+            over = self.budget is not None and self.items > self.budget
+        if over:
+            self._shrink(shop)
+
+    def dropped(self, shop: 'Shop'):
+        # called by Shop.evict, under shop.lock
+        with self.lock:
+            entry = self.lru.pop(shop.shop_id, None)
+            if entry:
+                self.items -= entry[1]
+                self.evictions += 1
+
+    def _shrink(self, keep: 'Shop'):
+        tried = {keep.shop_id}
+        while True:
+            with self.lock:
+                if self.items <= self.budget:
+                    return
+                victim = next((shop for shop_id, (shop, _) in self.lru.items() if shop_id not in tried), None)
+            if victim is None:
+                return
+            tried.add(victim.shop_id)
+            victim.evict()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'resident_shops': len(self.lru), 'resident_items': self.items, 'budget': self.budget}
+
+
+class Catalog:
+    # one per server process (see get_catalog in the app), shared by every session
+    def __init__(self, storage: Optional[Storage] = None, columnar: bool = False,
+                 menu_budget: Optional[int] = None):
+        self.storage = storage or Storage()
+        # menu representation for shops restored by load()
+        self.columnar = columnar
+        # menus in memory, at most menu_budget items' worth (see MenuCache)
+        self.menus = MenuCache(menu_budget)
+        self.shops = {}
+        # insertion order + position, for cursor paging without copying the dict
+        self.shop_order = []
+        self.shop_pos = {}
+        self.search_index = SearchIndex()
+        self.query_index = ItemQueryIndex()
+        self.directory = ShopDirectory()
+        # (normalized query, catalog version) -> ranked results; any edit moves
+        # the version, so stale entries are never hit and just age out
+        self.search_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.last_sync = 0.0
+        # version moves on any change; listing_version only when the shop list
+        # (names, ids, statuses) changes, which is all the shops page shows
+        self.version = 0
+        self.listing_version = 0
+
+    @metrics.timed('catalog.load')
+    def load(self) -> int:
+        # restore every stored shop; returns how many were loaded. menus past
+        # the budget are evicted again as soon as they are indexed
+        rows = self.storage.load()
+        for (shop_id, name, password, status), categories, items in rows:
+            shop = Shop(shop_id, name, password, self.columnar, status)
+            shop.restore(categories, items)
+            self.add_shop(shop, persist=False)
+        self.load_orders()
+        return len(rows)
+
+    def load_orders(self):
+        # every shop's queue from storage in one read, on startup
+        stored = self.storage.load_orders(ORDERS_DONE_KEEP)
+        for shop in list(self.shops.values()):
+            shop.orders.restore(stored.get(shop.shop_id, ()))
+
+    @metrics.timed('catalog.sync')
+    def sync(self) -> int:
+        # pick up writes made by other processes sharing the same storage.
+        # cheap when nothing changed (see SQLiteStorage.changed_shops), rate
+        # limited to once per SYNC_INTERVAL, and skipped if another thread is
+        # already syncing. returns how many shops were refreshed
+        now = time.monotonic()
+        if now - self.last_sync < SYNC_INTERVAL or not self.sync_lock.acquire(blocking=False):
+            return 0
+        try:
+            self.last_sync = now
+            return self.catch_up()
+        finally:
+            self.sync_lock.release()
+
+    def catch_up(self) -> int:
+        # the body of sync, unthrottled; caller holds sync_lock
+        changed = self.storage.changed_shops()
+        if changed is None:
+            changed = [row[0][0] for row in self.storage.load()]
+        for shop_id in changed:
+            self.refresh_shop(shop_id)
+        # orders placed, started or finished elsewhere; they never touch the menu
+        orders = self.storage.changed_orders()
+        if orders is None:
+            orders = list(self.shops)
+        for shop_id in orders:
+            shop = self.shops.get(shop_id)
+            if shop:
+                shop.orders.reload()
+        return len(changed)
+
+    def refresh_shop(self, shop_id: str):
+        # bring one shop in line with storage (written by someone else)
+        rows = self.storage.load_shop(shop_id)
+        if not rows:
+            return
+        (_, name, password, status), categories, items = rows
+        shop = self.shops.get(shop_id)
+        if shop is None:
+            shop = Shop(shop_id, name, password, self.columnar, status)
+            shop.restore(categories, items)
+            self.add_shop(shop, persist=False)
+            return
+        with shop.lock:
+            rebuilt = shop.apply_stored(status, categories, items)
+            # the menu may have been (re)built from storage after the write
+            # landed, or not be loaded at all, so the indexes are checked
+            # against the rows directly
+            if self.reindex(shop, items) or rebuilt:
+                shop._changed('synced', f"Menu updated elsewhere ({rebuilt} item(s))" if rebuilt
+                              else "Menu updated elsewhere", items=rebuilt)
+
+    def reindex(self, shop: Shop, items) -> bool:
+        # make both indexes match stored item rows for one shop; True if
+        # anything had to change
+        indexed = self.query_index.shop_items(shop.shop_id)
+        docs = self.search_index.docs
+        changed = False
+        for category_name, item_id, name, price, available in items:
+            have = indexed.pop(item_id, None)
+            it = Item(item_id, name, price, available)
+            doc = docs.get(('item', shop.shop_id, item_id))
+            if have and have[0] == category_name and doc and doc[1][0] == name.lower():
+                if have[1:] != (price, available):
+                    self.item_updated(shop, it, have[1])
+                    changed = True
+                continue
+            if have:
+                self.item_removed(shop, item_id)
+            self.item_added(shop, Category(category_name), it)
+            changed = True
+        for item_id in indexed:
+            self.item_removed(shop, item_id)
+            changed = True
+        return changed
+
+    def add_shop(self, shop: Shop, persist: bool = True, index: bool = True):
+        # index=False when the indexes come prebuilt (catalog_snapshot).
+        # stored and registered under the catalog lock, so a snapshot never
+        # sees a shop that is stored but not yet in the catalog
+        with shop.lock:
+            with self.lock:
+                if persist:
+                    self.storage.save_shop(shop)
+                shop.storage = self.storage
+                # fields set directly before the shop was added (status) show up in listings
+                shop.summary = shop._summarize()
+                if shop.shop_id not in self.shops:
+                    self.shop_pos[shop.shop_id] = len(self.shop_order)
+                    self.shop_order.append(shop.shop_id)
+                    self.directory.add(shop.shop_id, shop.name)
+                self.shops[shop.shop_id] = shop
+                shop.catalog = self
+                self.version += 1
+                self.listing_version += 1
+            if index:
+                self.search_index.add_shop(shop)
+                self.query_index.add_shop(shop)
+            if shop._menu is not None:
+                self.menus.loaded(shop, len(shop._menu.items))
+
+    def shop_changed(self, shop: Shop, listing: bool = False):
+        with self.lock:
+            self.version += 1
+            if listing:
+                self.listing_version += 1
+
+    def item_added(self, shop: Shop, cat: Category, it: Item):
+        self.search_index.add_item(shop, cat, it)
+        self.query_index.add_item(shop, cat, it)
+
+    def item_removed(self, shop: Shop, item_id: str):
+        self.search_index.remove_item(shop, item_id)
+        self.query_index.remove_item(shop, item_id)
+
+    def item_updated(self, shop: Shop, it: Item, old_price: Optional[float] = None):
+        self.query_index.update_item(shop, it, old_price)
+
+    def item_renamed(self, shop: Shop, cat: Category, it: Item):
+        self.search_index.remove_item(shop, it.item_id)
+        self.search_index.add_item(shop, cat, it)
+
+    def status_changed(self, shop: Shop, old_status: str):
+        self.query_index.status_changed(shop, old_status)
+
+    @metrics.timed('catalog.search')
+    def search(self, query: str, limit: int = 20):
+        # ranked, cached search; -> ([(key, payload, score)], total matches)
+        # where payload is the Shop for shop keys and (category, item) for items
+        q = query.strip().lower()
+        key = (q, self.version)
+        with self.lock:
+            hit = self.search_cache.get(key)
+            if hit and (hit[0] >= limit or len(hit[1]) == hit[2]):
+                self.search_cache.move_to_end(key)
+                return self._resolve(hit[1][:limit]), hit[2]
+        results, total = self.search_index.ranked(q, limit)
+        with self.lock:
+            self.search_cache[key] = (limit, results, total)
+            self.search_cache.move_to_end(key)
+            while len(self.search_cache) > SEARCH_CACHE_SIZE:
+                self.search_cache.popitem(last=False)
+        return self._resolve(results), total
+
+    def _resolve(self, ranked):
+        # index keys -> objects, outside the index lock; hits that went away
+        # in the meantime are dropped
+        out = []
+        for key, score in ranked:
+            shop = self.shops.get(key[1])
+            if shop is None:
+                continue
+            if key[0] == 'shop':
+                out.append((key, shop, score))
+                continue
+            cat, it = shop.find_item(key[2])
+            if it:
+                out.append((key, (cat, it), score))
+        return out
+
+    def query_items(self, **filters):
+        # see ItemQueryIndex.query; -> ([(shop, category, item)], next_offset)
+        docs, nxt = self.query_index.query(**filters)
+        rows = []
+        for shop_id, _, item_id, _ in docs:
+            shop = self.shops.get(shop_id)
+            cat, it = shop.find_item(item_id) if shop else (None, None)
+            if it:
+                rows.append((shop, cat, it))
+        return rows, nxt
+
+    def get(self, shop_id: str) -> Optional[Shop]:
+        return self.shops.get(shop_id)
+
+    def use(self, shop_id: str) -> Optional[Shop]:
+        # get() for a page or request about to read the shop's menu: counts
+        # one cache hit and keeps the menu warm
+        shop = self.shops.get(shop_id)
+        if shop and shop._menu is not None:
+            self.menus.hit(shop)
+        return shop
+
+    def find_shops(self, prefix: str, limit: int = 10) -> List[Shop]:
+        # typeahead lookup by shop id or name prefix (see ShopDirectory)
+        return [self.shops[i] for i in self.directory.match(prefix, limit)]
+
+    def list_shops(self) -> List[Shop]:
+        return list(self.shops.values())
+
+    def page_shops(self, cursor: Optional[str] = None, limit: int = 20):
+        # same contract as Menu.page, cursor is the shop_id the page starts at
+        start = self.shop_pos.get(cursor, 0) if cursor is not None else 0
+        ids = self.shop_order[start:start + limit + 1]
+        nxt = ids.pop() if len(ids) > limit else None
+        return [self.shops[i] for i in ids], nxt
+
+    def order_stats(self) -> dict:
+        # totals over every shop's OrderQueue, for the metrics export
+        waiting = preparing = busiest = 0
+        for shop in list(self.shops.values()):
+            n = len(shop.orders.waiting)
+            waiting += n
+            preparing += len(shop.orders.preparing)
+            busiest = max(busiest, n)
+        return {'waiting': waiting, 'preparing': preparing, 'max_waiting': busiest}
+
+    def versions(self):
+        return {shop_id: shop.version for shop_id, shop in self.shops.items()}
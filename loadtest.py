@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from bench import WORDS, git_rev, synthetic_catalog
+
+# headless load test: N customer and M vendor sessions driving the real app
+# through streamlit's AppTest (no browser, no network) against one shared
+# catalog, the way concurrent users share a server process.
+#
+#   python loadtest.py --customers 40 --vendors 4 --ramp 4 --rounds 10 --out load.json
+#
+# sessions are added in --ramp equal steps; each step runs --rounds rounds in
+# which every active session performs one action. customers mostly sit on a
+# page that auto-refreshes (a plain rerun), and sometimes open a shop, search
+# or go back to the list; vendors toggle an item on their dashboard. each step
+# reports rerun latency percentiles overall and per view_mode, plus RSS.
+#
+# AppTest has no timer, so an auto-refresh is modelled as a full rerun of the
+# page; in the browser the poll fragment is cheaper than that when idle.
+# AppTest also sets up a process-wide runtime per run, so reruns can't overlap:
+# sessions take turns, interleaved the way a busy server serves them.
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testtesttest.py')
+
+
+def rss_mb() -> float:
+    # current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return {'n': len(ordered), 'p50_ms': pick(50), 'p90_ms': pick(90), 'p99_ms': pick(99),
+            'max_ms': ordered[-1] * 1000, 'mean_ms': sum(ordered) / len(ordered) * 1000}
+
+
+def seed_database(path: str, shops: int, categories: int, items: int, seed: int):
+    from foodhub import Catalog
+    from storage import SQLiteStorage
+
+    target = Catalog(SQLiteStorage(path))
+    for shop in synthetic_catalog(shops, categories, items, seed).list_shops():
+        target.add_shop(shop)
+    target.storage.conn.close()
+
+
+class Session:
+    # one browser tab: an AppTest plus the role it plays
+    def __init__(self, role: str, shop_id: str, rng: random.Random, timeout: float):
+        from streamlit.testing.v1 import AppTest
+
+        # AppTest warns about every session_state write made outside a run
+        logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
+        self.role = role
+        self.shop_id = shop_id
+        self.rng = rng
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.at.session_state['authenticated'] = True
+        self.at.session_state['role'] = role
+        if role == 'vendor':
+            self.at.session_state['current_shop'] = shop_id
+            self.at.session_state['view_mode'] = 'vendor_dashboard'
+        self.errors = 0
+
+    def run(self, action=None):
+        # -> (view_mode the rerun rendered, seconds)
+        start = time.perf_counter()
+        (action or self.at).run()
+        elapsed = time.perf_counter() - start
+        if self.at.exception:
+            self.errors += 1
+        return self.at.session_state.view_mode, elapsed
+
+    def step(self):
+        if self.role == 'vendor':
+            toggles = [b for b in self.at.button if b.key and b.key.startswith('tog_v3_')]
+            return self.run(self.rng.choice(toggles).click() if toggles else None)
+        mode = self.at.session_state.view_mode
+        roll = self.rng.random()
+        if roll < 0.6:
+            return self.run()
+        if mode == 'shops':
+            opens = [b for b in self.at.button if b.key and b.key.startswith('open_v3_')]
+            if opens and roll < 0.85:
+                return self.run(self.rng.choice(opens).click())
+            return self.run(self.at.button(key='nav_search_v3').click())
+        if mode == 'search' and roll < 0.9:
+            self.at.text_input(key='search_input_v3').input(self.rng.choice(WORDS)[:self.rng.randint(2, 5)])
+            return self.run(self.at.button(key='search_main_btn_v3').click())
+        return self.run(self.at.button(key='nav_shops_v3').click())
+
+
+def load_test(customers: int, vendors: int, ramp: int, rounds: int, shop_ids, seed: int, timeout: float):
+    rng = random.Random(seed)
+    roles = ['customer'] * customers + ['vendor'] * vendors
+    rng.shuffle(roles)
+    sessions, steps = [], []
+    for step in range(1, ramp + 1):
+        target = len(roles) * step // ramp
+        fresh = []
+        while len(sessions) < target:
+            role = roles[len(sessions)]
+            s = Session(role, rng.choice(shop_ids), random.Random(rng.random()), timeout)
+            sessions.append(s)
+            fresh.append(s)
+        # the first run of a new session is the initial page load
+        first = [s.run() for s in fresh]
+        samples = {}
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for s in sessions:
+                mode, seconds = s.step()
+                samples.setdefault(mode, []).append(seconds)
+        wall = time.perf_counter() - started
+        everything = [s for v in samples.values() for s in v]
+        report = {
+            'sessions': len(sessions),
+            'customers': sum(s.role == 'customer' for s in sessions),
+            'vendors': sum(s.role == 'vendor' for s in sessions),
+            'reruns': len(everything),
+            'reruns_per_second': len(everything) / wall if wall else None,
+            'first_load': percentiles([seconds for _, seconds in first]),
+            'latency': percentiles(everything),
+            'by_view_mode': {mode: percentiles(v) for mode, v in sorted(samples.items())},
+            'rss_mb': rss_mb(),
+            'errors': sum(s.errors for s in sessions),
+        }
+        steps.append(report)
+        lat = report['latency']
+        print(f"{report['sessions']:4d} sessions  {report['reruns']:6d} reruns  p50 {lat.get('p50_ms', 0):7.1f} ms  "
+              f"p99 {lat.get('p99_ms', 0):7.1f} ms  rss {report['rss_mb']:7.1f} MB  errors {report['errors']}",
+              file=sys.stderr)
+    return steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FoodHub concurrent-session load test (streamlit AppTest)')
+    parser.add_argument('--customers', type=int, default=20)
+    parser.add_argument('--vendors', type=int, default=2)
+    parser.add_argument('--ramp', type=int, default=4, help='add sessions in this many equal steps')
+    parser.add_argument('--rounds', type=int, default=5, help='actions per session per step')
+    parser.add_argument('--shops', type=int, default=20)
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--items', type=int, default=20, help='items per category')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds allowed per rerun')
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    # a throwaway database, set before the app's cached catalog is first built
+    workdir = tempfile.mkdtemp(prefix='foodhub-load-')
+    os.environ['FOODHUB_DB'] = os.path.join(workdir, 'foodhub.db')
+    os.environ['FOODHUB_SNAPSHOT'] = os.path.join(workdir, 'foodhub.snap')
+    os.environ.pop('FOODHUB_API_PORT', None)
+    seed_database(os.environ['FOODHUB_DB'], args.shops, args.categories, args.items, args.seed)
+
+    steps = load_test(args.customers, args.vendors, args.ramp, args.rounds,
+                      [f's{i}' for i in range(args.shops)], args.seed, args.timeout)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': git_rev(),
+            'customers': args.customers, 'vendors': args.vendors, 'ramp': args.ramp, 'rounds': args.rounds,
+            'shops': args.shops, 'categories': args.categories,
+            'items_per_category': args.items, 'seed': args.seed,
+        },
+        'steps': steps,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
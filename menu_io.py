@@ -0,0 +1,112 @@
+import csv
+import json
+import math
+
+from foodhub import Shop
+
+FIELDS = ['category', 'item_id', 'name', 'price', 'available']
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if value is None or str(value).strip() == '':
+        return True
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'available')
+
+
+def read_csv(stream):
+    # yields (line_no, row dict); csv.DictReader pulls one line at a time
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, {'_error': f"invalid JSON ({e})"}
+            continue
+        yield line_no, row if isinstance(row, dict) else {'_error': 'expected a JSON object'}
+
+
+def read_rows(stream, fmt: str = 'csv'):
+    # read_csv/read_jsonl, with undecodable or malformed input reported as a
+    # row error (the text is decoded as it is read, so it can fail midway)
+    rows = read_jsonl(stream) if fmt == 'jsonl' else read_csv(stream)
+    line_no = 0
+    try:
+        for line_no, row in rows:
+            yield line_no, row
+    except UnicodeDecodeError:
+        yield line_no + 1, {'_error': 'the file is not UTF-8 text (save it as "CSV UTF-8")'}
+    except csv.Error as e:
+        yield line_no + 1, {'_error': f"invalid CSV ({e})"}
+
+
+def validate(shop: Shop, rows):
+    # single pass over the parsed rows: returns (items, errors) where items are
+    # (category, item_id, name, price, available) tuples ready for Shop.bulk_add.
+    # only these compact tuples are kept, never the raw file.
+    items, errors = [], []
+    seen = set()
+    for line_no, row in rows:
+        if '_error' in row:
+            errors.append((line_no, row['_error']))
+            continue
+        category = str(row.get('category') or '').strip()
+        item_id = str(row.get('item_id') or '').strip()
+        name = str(row.get('name') or '').strip()
+        if not category or not item_id or not name:
+            errors.append((line_no, 'category, item_id and name are required'))
+            continue
+        try:
+            # JSON true/false would otherwise pass as 1.0/0.0
+            if isinstance(row.get('price'), bool):
+                raise TypeError
+            price = float(row.get('price'))
+        except (TypeError, ValueError):
+            errors.append((line_no, f"invalid price {row.get('price')!r}"))
+            continue
+        if price < 0 or not math.isfinite(price):
+            errors.append((line_no, f"invalid price {row.get('price')!r}"))
+            continue
+        if item_id in seen or item_id in shop.items:
+            errors.append((line_no, f"duplicate item id {item_id}"))
+            continue
+        seen.add(item_id)
+        items.append((category, item_id, name, price, _parse_bool(row.get('available'))))
+    return items, errors
+
+
+def import_menu(shop: Shop, stream, fmt: str = 'csv'):
+    # all-or-nothing: nothing is applied if any row fails validation.
+    # returns (number of items added, errors)
+    items, errors = validate(shop, read_rows(stream, fmt))
+    if errors:
+        return 0, errors
+    return shop.bulk_add(items), []
+
+
+def export_rows(shop: Shop):
+    # reads the published snapshot, so an export never sees a half-applied edit
+    for cat in shop.snapshot.categories:
+        for it in cat.items:
+            yield dict(zip(FIELDS, (cat.name, it.item_id, it.name, it.price, it.available)))
+
+
+def write_csv(shop: Shop, stream):
+    writer = csv.DictWriter(stream, fieldnames=FIELDS)
+    writer.writeheader()
+    for row in export_rows(shop):
+        writer.writerow(row)
+
+
+def write_jsonl(shop: Shop, stream):
+    for row in export_rows(shop):
+        stream.write(json.dumps(row) + '\n')
@@ -0,0 +1,177 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# in-process instrumentation. spans time a named block, counters count things
+# (items rendered, widgets created). both are aggregated process-wide for the
+# Prometheus export (api.py serves it at /metrics) and, while a script run is
+# in progress on the current thread, also collected per rerun: the app starts a
+# Rerun at the top of the script and finishes it at the end, which hands back
+# a breakdown for the debug panel and, if FOODHUB_METRICS_JSONL is set,
+# appends it to that file as one JSON line.
+#
+# spans only go around coarse operations (a search, a snapshot publish, a view
+# branch); the per-item structures are measured by bench.py instead.
+
+JSONL_PATH = os.environ.get('FOODHUB_METRICS_JSONL')
+PROFILE_LINES = 25
+
+_lock = threading.Lock()
+# name -> [count, total seconds, max seconds]
+_spans = {}
+_counters = {}
+# name -> callable returning {key: number}, read at export time for state
+# that lives elsewhere (the catalog's menu cache)
+_gauges = {}
+_local = threading.local()
+
+
+def _record(name: str, seconds: float):
+    with _lock:
+        agg = _spans.get(name)
+        if agg is None:
+            _spans[name] = [1, seconds, seconds]
+        else:
+            agg[0] += 1
+            agg[1] += seconds
+            if seconds > agg[2]:
+                agg[2] = seconds
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is not None:
+        rerun.spans[name] = rerun.spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    # decorator form of span
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+        return inner
+    return wrap
+
+
+def observe(name: str, seconds: float):
+    # a duration measured elsewhere (e.g. how long an order waited); reported
+    # like a span
+    _record(name, seconds)
+
+
+def count(name: str, n: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is not None:
+        rerun.counters[name] = rerun.counters.get(name, 0) + n
+
+
+def gauge(name: str, read):
+    _gauges[name] = read
+
+
+def gauges() -> dict:
+    # -> {name: {key: number}}
+    return {name: read() for name, read in list(_gauges.items())}
+
+
+class Rerun:
+    # one script run on this thread; profile=True runs it under cProfile
+    def __init__(self, profile: bool = False):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.profiler = None
+        self.current = None
+        self.phase_started = self.started
+        if profile:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self.profiler = profiler
+            except ValueError:
+                # another profiler is active (3.12+ allows only one at a time)
+                pass
+        _local.rerun = self
+
+    def phase(self, name: str):
+        # the script runs top to bottom, so it is split into consecutive
+        # phases (css, header, view.<mode>...): each one ends where the next
+        # starts, and the last one at finish()
+        now = time.perf_counter()
+        if self.current:
+            _record(self.current, now - self.phase_started)
+        self.current, self.phase_started = name, now
+
+    def finish(self, view: str) -> dict:
+        self.phase(None)
+        seconds = time.perf_counter() - self.started
+        profile = None
+        if self.profiler:
+            self.profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            profile = out.getvalue()
+        if getattr(_local, 'rerun', None) is self:
+            _local.rerun = None
+        _record(f'rerun.{view}', seconds)
+        record = {'at': time.time(), 'view': view, 'seconds': seconds,
+                  'spans': self.spans, 'counters': self.counters}
+        if JSONL_PATH:
+            with _lock, open(JSONL_PATH, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        if profile:
+            record['profile'] = profile
+        return record
+
+
+def snapshot():
+    # -> ({span: (count, total, max)}, {counter: value})
+    with _lock:
+        return {k: tuple(v) for k, v in _spans.items()}, dict(_counters)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus() -> str:
+    spans, counters = snapshot()
+    lines = ['# HELP foodhub_span_seconds Time spent in instrumented spans.',
+             '# TYPE foodhub_span_seconds summary']
+    for name, (n, total, _) in sorted(spans.items()):
+        lines.append(f'foodhub_span_seconds_count{{span="{_label(name)}"}} {n}')
+        lines.append(f'foodhub_span_seconds_sum{{span="{_label(name)}"}} {total:.6f}')
+    lines += ['# HELP foodhub_span_max_seconds Slowest single run of each span.',
+              '# TYPE foodhub_span_max_seconds gauge']
+    for name, (_, _, worst) in sorted(spans.items()):
+        lines.append(f'foodhub_span_max_seconds{{span="{_label(name)}"}} {worst:.6f}')
+    lines += ['# HELP foodhub_events_total Instrumentation counters.',
+              '# TYPE foodhub_events_total counter']
+    for name, value in sorted(counters.items()):
+        lines.append(f'foodhub_events_total{{name="{_label(name)}"}} {value}')
+    lines += ['# HELP foodhub_state Readings taken at export time.',
+              '# TYPE foodhub_state gauge']
+    for source, values in sorted(gauges().items()):
+        for name, value in sorted(values.items()):
+            if isinstance(value, (int, float)):
+                lines.append(f'foodhub_state{{source="{_label(source)}",name="{_label(name)}"}} {value}')
+    return '\n'.join(lines) + '\n'
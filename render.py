@@ -0,0 +1,85 @@
+from html import escape
+from typing import Optional
+
+import metrics
+from foodhub import Shop
+
+# _card_cache is keyed by shop_id, _menu_cache by (shop_id, limit); values are
+# (version, html). markup only changes when the shop version does, so one entry
+# per key is enough and stale entries are simply replaced.
+_menu_cache = {}
+_card_cache = {}
+
+
+# the only change kinds that show up on a shop card
+CARD_CHANGES = {'status_changed'}
+
+
+@metrics.timed('render.shop_card')
+def shop_card_html(shop: Shop) -> str:
+    hit = _card_cache.get(shop.shop_id)
+    if hit:
+        if hit[0] == shop.version:
+            return hit[1]
+        # menu edits don't touch the card; roll the cached entry forward
+        events, complete = shop.changes_since(hit[0])
+        if complete and events and not any(e.kind in CARD_CHANGES for e in events):
+            _card_cache[shop.shop_id] = (events[-1].seq, hit[1])
+            return hit[1]
+    # the summary, so listing shops never loads a menu
+    snap = shop.summary
+    html = (
+        f"<div class='shop-card'><div style='display:flex; justify-content:space-between; align-items:center; gap:16px;'>"
+        f"<div style='display:flex; align-items:center; gap:12px;'><div class='accent-strip'></div>"
+        f"<div><strong style='font-size:1.05rem'>{escape(snap.name)}</strong>"
+        f"<div class='muted'>Status: {escape(snap.status)} • ID: {escape(snap.shop_id)}</div></div>"
+        f"</div></div></div>"
+    )
+    _card_cache[shop.shop_id] = (snap.version, html)
+    return html
+
+
+def snapshot_item(shop: Shop, category_name: str, item_id: str):
+    # the published ItemView for a live search/query hit, or None if the
+    # snapshot doesn't (or no longer) contain it
+    cat = shop.snapshot.cats.get(category_name)
+    return cat.index.get(item_id) if cat else None
+
+
+def menu_item_html(it) -> str:
+    status = 'Available' if it.available else 'Sold Out'
+    return (
+        f"<div class='menu-item'>"
+        f"<div><strong>{escape(it.name)}</strong><div class='muted'>ID: {escape(it.item_id)} • {status}</div></div>"
+        f"<div style='min-width:110px; text-align:right;'>₱{it.price:.2f}</div></div>"
+    )
+
+
+@metrics.timed('render.menu')
+def menu_html(shop: Shop, limit: Optional[int] = None) -> str:
+    # the whole menu as one block, so the detail page is a single delta.
+    # limit caps the items shown per category (the "show more" view).
+    # built from the published snapshot, so it never waits on a writer
+    snap = shop.snapshot
+    hit = _menu_cache.get((shop.shop_id, limit))
+    if hit and hit[0] == snap.version:
+        return hit[1]
+    parts = []
+    for cat in snap.categories:
+        parts.append(f"<p><strong>{escape(cat.name)}</strong></p>")
+        if not cat.items:
+            parts.append("<ul><li>(no items)</li></ul>")
+            continue
+        items = cat.items[:limit] if limit else cat.items
+        parts.extend(menu_item_html(it) for it in items)
+        if len(items) < len(cat.items):
+            parts.append(f"<div class='muted'>+ {len(cat.items) - len(items)} more</div>")
+    html = ''.join(parts)
+    _menu_cache[(shop.shop_id, limit)] = (snap.version, html)
+    return html
+
+
+def updates_md(updates) -> str:
+    if not updates:
+        return 'No updates yet'
+    return '\n'.join('- ' + u for u in reversed(updates))
@@ -0,0 +1,399 @@
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+
+class Storage:
+    # default backend: keeps nothing, every call is a no-op. Shop calls these
+    # after each in-memory change (write-through), so the objects in memory
+    # stay the read path and a backend only has to persist.
+    def load(self):
+        # -> [(shop_row, [category names], [item rows])]
+        return []
+
+    def load_shop(self, shop_id: str):
+        # -> (shop_row, [category names], [item rows]) or None
+        return None
+
+    def changed_shops(self):
+        # shop ids written by *other* processes since the last call; None
+        # means "too far behind, reload everything"
+        return []
+
+    def changed_orders(self):
+        # same for order queues; only moves when changed_shops is called
+        return []
+
+    # True if load_shop returns what was written, so an in-memory menu can be
+    # dropped and read back later (see Shop.evict)
+    durable = False
+
+    def mark(self) -> int:
+        # position in the write history, for changed_since
+        return 0
+
+    def changed_since(self, mark: int):
+        # shop ids written (by anyone) after mark; None if that history is gone
+        return []
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def save_shop(self, shop):
+        pass
+
+    def set_status(self, shop_id: str, status: str):
+        pass
+
+    def add_category(self, shop_id: str, category_name: str):
+        pass
+
+    def add_item(self, shop_id: str, category_name: str, item_id: str, name: str, price: float, available: bool) -> bool:
+        # False if another process already stored an item with this id
+        return True
+
+    def add_items(self, shop_id: str, rows):
+        # rows: (category, item_id, name, price, available), in menu order.
+        # -> the rows actually stored, without ids some other process stored first
+        return list(rows)
+
+    def remove_item(self, shop_id: str, item_id: str):
+        pass
+
+    def set_available(self, shop_id: str, item_id: str, available: bool):
+        pass
+
+    def set_price(self, shop_id: str, item_id: str, price: float):
+        pass
+
+    def set_name(self, shop_id: str, item_id: str, name: str):
+        pass
+
+    def reorder(self, shop_id: str, category_name: str, item_ids):
+        pass
+
+    # order rows: (seq, customer, lines, prep_seconds, placed_at, started_at,
+    # completed_at, status), every open order plus the last `done` finished ones
+    def load_orders(self, done: int):
+        # -> {shop_id: [order rows]}
+        return {}
+
+    def load_shop_orders(self, shop_id: str, done: int):
+        return []
+
+    def add_order(self, shop_id: str, order) -> int:
+        # -> the order's number within the shop, 0 to let the queue pick one
+        return 0
+
+    def start_orders(self, shop_id: str, seqs, at: float):
+        # -> the seqs that were still waiting; only those were started
+        return list(seqs)
+
+    def complete_orders(self, shop_id: str, seqs, at: float):
+        pass
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shops (
+    shop_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    password TEXT NOT NULL,
+    status TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS categories (
+    shop_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (shop_id, name)
+);
+CREATE TABLE IF NOT EXISTS items (
+    shop_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    available INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (shop_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_by_category ON items (shop_id, category, position);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    shop_id TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'shop'
+);
+CREATE TABLE IF NOT EXISTS orders (
+    shop_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    customer TEXT NOT NULL,
+    lines TEXT NOT NULL,
+    prep_seconds REAL NOT NULL,
+    placed_at REAL NOT NULL,
+    started_at REAL,
+    completed_at REAL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (shop_id, seq)
+);
+CREATE INDEX IF NOT EXISTS orders_by_status ON orders (shop_id, status, completed_at);
+'''
+
+# fixed statement text, so sqlite3's statement cache keeps them prepared
+UPSERT_SHOP = 'INSERT OR REPLACE INTO shops (shop_id, name, password, status, seq) VALUES (?, ?, ?, ?, COALESCE((SELECT seq FROM shops WHERE shop_id = ?), (SELECT COUNT(*) FROM shops)))'
+SET_STATUS = 'UPDATE shops SET status = ? WHERE shop_id = ?'
+ADD_CATEGORY = 'INSERT OR IGNORE INTO categories (shop_id, name, seq) VALUES (?, ?, (SELECT COUNT(*) FROM categories WHERE shop_id = ?))'
+ADD_ITEM = ('INSERT INTO items (shop_id, item_id, category, name, price, available, position) VALUES '
+            '(?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM items WHERE shop_id = ? AND category = ?))')
+INSERT_ITEM = 'INSERT OR REPLACE INTO items (shop_id, item_id, category, name, price, available, position) VALUES (?, ?, ?, ?, ?, ?, ?)'
+HAS_ITEM = 'SELECT 1 FROM items WHERE shop_id = ? AND item_id = ?'
+REMOVE_ITEM = 'DELETE FROM items WHERE shop_id = ? AND item_id = ?'
+SET_AVAILABLE = 'UPDATE items SET available = ? WHERE shop_id = ? AND item_id = ?'
+SET_PRICE = 'UPDATE items SET price = ? WHERE shop_id = ? AND item_id = ?'
+SET_NAME = 'UPDATE items SET name = ? WHERE shop_id = ? AND item_id = ?'
+SET_POSITION = 'UPDATE items SET position = ? WHERE shop_id = ? AND item_id = ?'
+ADD_EVENT = 'INSERT INTO events (shop_id, origin, kind) VALUES (?, ?, ?)'
+EVENTS_AFTER = 'SELECT DISTINCT shop_id, kind FROM events WHERE id > ? AND origin != ?'
+ADD_ORDER = ('INSERT INTO orders (shop_id, seq, customer, lines, prep_seconds, placed_at, status) VALUES '
+             "(?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM orders WHERE shop_id = ?), ?, ?, ?, ?, 'waiting')")
+START_ORDER = "UPDATE orders SET status = 'preparing', started_at = ? WHERE shop_id = ? AND seq = ? AND status = 'waiting'"
+COMPLETE_ORDER = "UPDATE orders SET status = 'done', completed_at = ? WHERE shop_id = ? AND seq = ? AND status = 'preparing'"
+ORDER_COLUMNS = 'seq, customer, lines, prep_seconds, placed_at, started_at, completed_at, status'
+# open orders, then the most recently finished ones (per shop)
+OPEN_ORDERS = f"SELECT shop_id, {ORDER_COLUMNS} FROM orders WHERE status != 'done'"
+DONE_ORDERS = (f"SELECT shop_id, {ORDER_COLUMNS} FROM (SELECT *, ROW_NUMBER() OVER "
+               "(PARTITION BY shop_id ORDER BY completed_at DESC) AS n FROM orders WHERE status = 'done') WHERE n <= ?")
+
+# how many change notifications the events table keeps; a process that falls
+# further behind than this reloads the whole catalog
+EVENT_RETENTION = 10000
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path: str):
+        self.path = path
+        # one connection shared by the script threads; the lock serializes it
+        # and keeps other threads out of an open batch
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        if 'kind' not in [row[1] for row in self.conn.execute('PRAGMA table_info(events)')]:
+            # databases from before orders were stored
+            self.conn.execute("ALTER TABLE events ADD COLUMN kind TEXT NOT NULL DEFAULT 'shop'")
+        # several server processes can share one database file. every write
+        # also appends an (shop_id, origin) row to events; other processes
+        # notice via PRAGMA data_version and read only the new event ids
+        self.origin = uuid.uuid4().hex
+        self.last_event = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        self.data_version = self._data_version()
+        self.written = 0
+        # order queues changed elsewhere, collected by changed_shops for
+        # changed_orders; None once too far behind
+        self.orders_changed = set()
+
+    @contextmanager
+    def batch(self):
+        # nested batches join the outer transaction
+        with self.lock:
+            if self.depth == 0:
+                self.conn.execute('BEGIN IMMEDIATE')
+            self.depth += 1
+            try:
+                yield
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.conn.execute('ROLLBACK')
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.conn.execute('COMMIT')
+
+    def _write(self, sql: str, args, shop_id: str):
+        with self.batch():
+            self.conn.execute(sql, args)
+            self._notify(shop_id)
+
+    def _notify(self, shop_id: str, kind: str = 'shop'):
+        # caller is inside a batch. kind is 'shop' for catalog writes and
+        # 'order' for order queues, which other processes re-read separately
+        self.conn.execute(ADD_EVENT, (shop_id, self.origin, kind))
+        self.written += 1
+        if self.written % 1000 == 0:
+            self.conn.execute('DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?', (EVENT_RETENTION,))
+
+    def _data_version(self) -> int:
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def changed_shops(self):
+        with self.lock:
+            # data_version only moves when another connection commits, so an
+            # idle database costs one pragma per call
+            version = self._data_version()
+            if version == self.data_version:
+                return []
+            self.data_version = version
+            first, last = self.conn.execute('SELECT MIN(id), MAX(id) FROM events').fetchone()
+            if last is None or last <= self.last_event:
+                return []
+            behind = first > self.last_event + 1
+            ids = []
+            for shop_id, kind in self.conn.execute(EVENTS_AFTER, (self.last_event, self.origin)):
+                if kind == 'order':
+                    if self.orders_changed is not None:
+                        self.orders_changed.add(shop_id)
+                else:
+                    ids.append(shop_id)
+            self.last_event = last
+            if behind:
+                self.orders_changed = None
+        return None if behind else ids
+
+    def changed_orders(self):
+        with self.lock:
+            changed, self.orders_changed = self.orders_changed, set()
+        return None if changed is None else list(changed)
+
+    durable = True
+
+    def mark(self) -> int:
+        # everything up to the mark is in memory: this process's own writes as
+        # they happen, other processes' once changed_shops has handed them out
+        with self.lock:
+            last = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            if self._data_version() != self.data_version:
+                return min(last, self.last_event)
+            return last
+
+    def changed_since(self, mark: int):
+        with self.lock:
+            first, last = self.conn.execute('SELECT MIN(id), MAX(id) FROM events').fetchone()
+            if last is None:
+                return [] if mark == 0 else None
+            # a mark past the end belongs to some other (or a recreated) database
+            if last < mark or first > mark + 1:
+                return None
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT shop_id FROM events WHERE id > ? AND kind = 'shop'", (mark,))]
+
+    def load_shop(self, shop_id: str):
+        with self.lock:
+            shop = self.conn.execute('SELECT shop_id, name, password, status FROM shops WHERE shop_id = ?', (shop_id,)).fetchone()
+            if not shop:
+                return None
+            cats = [row[0] for row in self.conn.execute('SELECT name FROM categories WHERE shop_id = ? ORDER BY seq', (shop_id,))]
+            items = [(row[0], row[1], row[2], row[3], bool(row[4])) for row in self.conn.execute(
+                'SELECT category, item_id, name, price, available FROM items WHERE shop_id = ? ORDER BY category, position', (shop_id,))]
+        return shop, cats, items
+
+    def load(self):
+        with self.lock:
+            shops = self.conn.execute('SELECT shop_id, name, password, status FROM shops ORDER BY seq').fetchall()
+            cats = {}
+            for shop_id, name in self.conn.execute('SELECT shop_id, name FROM categories ORDER BY shop_id, seq'):
+                cats.setdefault(shop_id, []).append(name)
+            items = {}
+            for row in self.conn.execute('SELECT shop_id, category, item_id, name, price, available FROM items '
+                                         'ORDER BY shop_id, category, position'):
+                items.setdefault(row[0], []).append((row[1], row[2], row[3], row[4], bool(row[5])))
+        return [(shop, cats.get(shop[0], []), items.get(shop[0], [])) for shop in shops]
+
+    def save_shop(self, shop):
+        # full dump of one shop in a single transaction (used when a shop is
+        # first registered, e.g. seeding)
+        rows = []
+        for cat_name, cat in shop.menu_tree.children.items():
+            for pos, it in enumerate(cat.items_list, 1):
+                rows.append((shop.shop_id, it.item_id, cat_name, it.name, it.price, int(it.available), pos))
+        with self.batch():
+            self.conn.execute(UPSERT_SHOP, (shop.shop_id, shop.name, shop.password, shop.status, shop.shop_id))
+            self.conn.executemany(ADD_CATEGORY, [(shop.shop_id, c, shop.shop_id) for c in shop.menu_tree.children])
+            self.conn.executemany(INSERT_ITEM, rows)
+            self._notify(shop.shop_id)
+
+    def set_status(self, shop_id: str, status: str):
+        self._write(SET_STATUS, (status, shop_id), shop_id)
+
+    def add_category(self, shop_id: str, category_name: str):
+        self._write(ADD_CATEGORY, (shop_id, category_name, shop_id), shop_id)
+
+    def add_item(self, shop_id: str, category_name: str, item_id: str, name: str, price: float, available: bool) -> bool:
+        with self.batch():
+            if self.conn.execute(HAS_ITEM, (shop_id, item_id)).fetchone():
+                return False
+            self.conn.execute(ADD_CATEGORY, (shop_id, category_name, shop_id))
+            self.conn.execute(ADD_ITEM, (shop_id, item_id, category_name, name, price, int(available), shop_id, category_name))
+            self._notify(shop_id)
+        return True
+
+    def add_items(self, shop_id: str, rows):
+        with self.batch():
+            stored = {row[0] for row in self.conn.execute('SELECT item_id FROM items WHERE shop_id = ?', (shop_id,))}
+            rows = [r for r in rows if r[1] not in stored]
+            if rows:
+                self.conn.executemany(ADD_CATEGORY, [(shop_id, c, shop_id) for c in dict.fromkeys(r[0] for r in rows)])
+                self.conn.executemany(ADD_ITEM, [(shop_id, i, c, n, p, int(a), shop_id, c) for c, i, n, p, a in rows])
+                self._notify(shop_id)
+        return rows
+
+    def remove_item(self, shop_id: str, item_id: str):
+        self._write(REMOVE_ITEM, (shop_id, item_id), shop_id)
+
+    def set_available(self, shop_id: str, item_id: str, available: bool):
+        self._write(SET_AVAILABLE, (int(available), shop_id, item_id), shop_id)
+
+    def set_price(self, shop_id: str, item_id: str, price: float):
+        self._write(SET_PRICE, (price, shop_id, item_id), shop_id)
+
+    def set_name(self, shop_id: str, item_id: str, name: str):
+        self._write(SET_NAME, (name, shop_id, item_id), shop_id)
+
+    def reorder(self, shop_id: str, category_name: str, item_ids):
+        with self.batch():
+            self.conn.executemany(SET_POSITION, [(pos, shop_id, i) for pos, i in enumerate(item_ids, 1)])
+            self._notify(shop_id)
+
+    def _order_rows(self, rows):
+        return [(seq, customer, tuple(tuple(line) for line in json.loads(lines)), prep, placed, started, completed, status)
+                for seq, customer, lines, prep, placed, started, completed, status in rows]
+
+    def load_orders(self, done: int):
+        orders = {}
+        with self.lock:
+            for row in self.conn.execute(f'{OPEN_ORDERS} UNION ALL {DONE_ORDERS} ORDER BY seq', (done,)):
+                orders.setdefault(row[0], []).append(row[1:])
+        return {shop_id: self._order_rows(rows) for shop_id, rows in orders.items()}
+
+    def load_shop_orders(self, shop_id: str, done: int):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {ORDER_COLUMNS} FROM orders WHERE shop_id = ? AND status != 'done' UNION ALL "
+                f"SELECT * FROM (SELECT {ORDER_COLUMNS} FROM orders WHERE shop_id = ? AND status = 'done' "
+                'ORDER BY completed_at DESC LIMIT ?) ORDER BY seq', (shop_id, shop_id, done)).fetchall()
+        return self._order_rows(rows)
+
+    def add_order(self, shop_id: str, order) -> int:
+        with self.batch():
+            cur = self.conn.execute(ADD_ORDER, (shop_id, shop_id, order.customer, json.dumps(order.lines),
+                                                order.prep_seconds, order.placed_at))
+            seq = self.conn.execute('SELECT seq FROM orders WHERE rowid = ?', (cur.lastrowid,)).fetchone()[0]
+            self._notify(shop_id, 'order')
+        return seq
+
+    def start_orders(self, shop_id: str, seqs, at: float):
+        # another process may have started some of them first
+        with self.batch():
+            started = [seq for seq in seqs if self.conn.execute(START_ORDER, (at, shop_id, seq)).rowcount]
+            if started:
+                self._notify(shop_id, 'order')
+        return started
+
+    def complete_orders(self, shop_id: str, seqs, at: float):
+        with self.batch():
+            self.conn.executemany(COMPLETE_ORDER, [(at, shop_id, seq) for seq in seqs])
+            self._notify(shop_id, 'order')
@@ -0,0 +1,49 @@
+import pytest
+
+from foodhub import Catalog, Shop
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'foodhub.db')
+
+
+@pytest.fixture
+def open_catalog(db_path):
+    # -> another "process" on the same database, optionally loaded from it
+    def open_catalog(load=True):
+        catalog = Catalog(SQLiteStorage(db_path))
+        if load:
+            catalog.load()
+        return catalog
+    return open_catalog
+
+
+@pytest.fixture
+def stored_catalog(open_catalog):
+    # -> catalog that has stored Tito Jims Grill (s1: m1, m2), plus `extra`
+    # one-item shops s2, s3, ...
+    def stored_catalog(extra=0, status=None):
+        catalog = open_catalog(load=False)
+        shop = Shop('s1', 'Tito Jims Grill', 'pw')
+        shop.add_item('Meals', 'm1', 'Chicken BBQ', 120.0)
+        shop.add_item('Meals', 'm2', 'Pork Sisig', 80.0)
+        catalog.add_shop(shop)
+        if status:
+            shop.set_status(status)
+        for n in range(2, extra + 2):
+            shop = Shop(f's{n}', f'Shop {n}', 'pw')
+            shop.add_item('Meals', f'x{n}', f'Meal {n}', 10.0 + n)
+            catalog.add_shop(shop)
+        return catalog
+    return stored_catalog
+
+
+@pytest.fixture
+def sync():
+    # Catalog.sync without the SYNC_INTERVAL throttle
+    def sync(catalog):
+        catalog.last_sync = 0
+        return catalog.sync()
+    return sync
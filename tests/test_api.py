@@ -0,0 +1,35 @@
+import json
+import urllib.request
+from urllib.error import HTTPError
+
+import api
+from foodhub import Catalog, Shop
+
+
+def get(server, path, tag=None):
+    request = urllib.request.Request(f'http://127.0.0.1:{server.server_port}{path}',
+                                     headers={'If-None-Match': tag} if tag else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers['ETag'], json.loads(response.read())
+    except HTTPError as e:
+        return e.code, e.headers['ETag'], None
+
+
+def test_shop_list_tag_covers_its_body():
+    catalog = Catalog()
+    shop = Shop('s1', 'Tito Jims Grill', 'pw')
+    shop.add_item('Meals', 'm1', 'Chicken BBQ', 120.0)
+    catalog.add_shop(shop)
+    server = api.serve_in_thread(catalog, port=0)
+    try:
+        code, tag, body = get(server, '/shops')
+        shop.set_price('Meals', 'm1', 99.0)
+        # a menu edit leaves the listing as it was, so the cached body is still right
+        assert get(server, '/shops', tag)[0] == 304
+        assert get(server, '/shops')[2] == body
+        shop.set_status('Open')
+        assert get(server, '/shops', tag)[0] == 200
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,159 @@
+import random
+
+import pytest
+
+import catalog_snapshot
+from foodhub import SHOP_STATUSES, Catalog, Shop
+
+WORDS = ['adobo', 'sisig', 'lechon', 'halo', 'halo-halo', 'pancit', 'tea', 'iced', 'cake', 'ube', 'bbq', 'grill']
+
+
+def random_name(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).title()
+
+
+def random_catalog(seed, shops=8, items=30):
+    rng = random.Random(seed)
+    catalog = Catalog()
+    for n in range(shops):
+        shop = Shop(f's{n}', random_name(rng), 'pw')
+        shop.status = rng.choice(SHOP_STATUSES)
+        for i in range(items):
+            shop.add_item(f'c{rng.randint(0, 3)}', f'i{n}x{i}', random_name(rng), float(rng.randint(1, 40)))
+        catalog.add_shop(shop)
+    return catalog, rng
+
+
+def edit(catalog, rng, rounds=60):
+    # removals, renames, re-prices, sold-outs, status changes and new items
+    for n in range(rounds):
+        shop = catalog.get(rng.choice(list(catalog.shops)))
+        ids = list(shop.items)
+        op = rng.randrange(6)
+        if op == 0 and ids:
+            item_id = rng.choice(ids)
+            shop.remove_item(shop.items[item_id][0].name, item_id)
+        elif op == 1 and ids:
+            item_id = rng.choice(ids)
+            shop.rename_item(shop.items[item_id][0].name, item_id, random_name(rng))
+        elif op == 2 and ids:
+            item_id = rng.choice(ids)
+            shop.set_price(shop.items[item_id][0].name, item_id, float(rng.randint(1, 40)))
+        elif op == 3 and ids:
+            item_id = rng.choice(ids)
+            shop.toggle_availability(shop.items[item_id][0].name, item_id, rng.random() < 0.5)
+        elif op == 4:
+            shop.set_status(rng.choice(SHOP_STATUSES))
+        else:
+            shop.add_item(f'c{rng.randint(0, 3)}', f'new{n}', random_name(rng), float(rng.randint(1, 40)))
+
+
+def documents(catalog):
+    # key -> searched fields, straight from the shops
+    docs = {}
+    for shop in catalog.shops.values():
+        docs[('shop', shop.shop_id)] = (shop.name.lower(), shop.shop_id.lower())
+        for _, it in shop.items.values():
+            docs[('item', shop.shop_id, it.item_id)] = (it.name.lower(), it.item_id.lower())
+    return docs
+
+
+def queries(rng, docs, n=80):
+    fields = [f for pair in docs.values() for f in pair]
+    out = ['zzz', 'q', 'halo-hal', 'x1', 'i1x']
+    for _ in range(n):
+        f = rng.choice(fields)
+        start = rng.randrange(len(f))
+        out.append(f[start:start + rng.randint(1, 6)])
+    return out
+
+
+def assert_search_matches_scan(catalog, rng):
+    docs = documents(catalog)
+    for q in queries(rng, docs):
+        expected = {k for k, fields in docs.items() if any(q in f for f in fields)}
+        assert set(catalog.search_index.search(q)) == expected, q
+
+
+def test_search_matches_full_scan():
+    catalog, rng = random_catalog(1)
+    assert_search_matches_scan(catalog, rng)
+    edit(catalog, rng)
+    assert_search_matches_scan(catalog, rng)
+
+
+@pytest.mark.parametrize('seed', [2, 3])
+def test_search_matches_full_scan_after_restore_and_repack(tmp_path, seed):
+    catalog, rng = random_catalog(seed)
+    edit(catalog, rng)
+    first, second = str(tmp_path / 'first.snap'), str(tmp_path / 'second.snap')
+    catalog_snapshot.write_snapshot(catalog, first)
+    restored = Catalog()
+    assert catalog_snapshot.load_snapshot(restored, first) == len(catalog.shops)
+    assert_search_matches_scan(restored, rng)
+    # some grams are read back, some edited, the rest still only in the file
+    edit(restored, rng, 20)
+    catalog_snapshot.write_snapshot(restored, second)
+    again = Catalog()
+    assert catalog_snapshot.load_snapshot(again, second) == len(restored.shops)
+    assert_search_matches_scan(again, rng)
+    assert documents(again) == documents(restored)
+
+
+def test_ranked_search_through_the_cache():
+    catalog, rng = random_catalog(4)
+    index = catalog.search_index
+
+    def expected(q):
+        keys = [k for k, fields in documents(catalog).items() if any(q in f for f in fields)]
+
+        def score(k):
+            name, ident = documents(catalog)[k]
+            return (index.EXACT if q == ident else index.PREFIX if name.startswith(q) or ident.startswith(q)
+                    else index.SUBSTRING), index.docs[k][0]
+        return sorted(keys, key=score)
+
+    for q in queries(rng, documents(catalog), 30):
+        # Catalog.search trims the query
+        q = q.strip()
+        full = expected(q)
+        if not full:
+            continue
+        # a short page first, so the longer one has to look past the cached entry
+        for limit in (3, 50, 3):
+            results, total = catalog.search(q, limit)
+            assert total == len(full)
+            assert [k for k, _, _ in results] == full[:limit]
+        edit(catalog, rng, 5)
+        results, total = catalog.search(q, 50)
+        assert [k for k, _, _ in results] == expected(q)[:50]
+
+
+def test_paged_query_matches_filtered_sort():
+    catalog, rng = random_catalog(5)
+    edit(catalog, rng)
+    rows = [(shop, cat, it) for shop in catalog.shops.values() for cat, it in shop.items.values()]
+    doc_of = catalog.query_index.doc_of
+    for _ in range(40):
+        filters = {'min_price': rng.choice([None, float(rng.randint(1, 40))]),
+                   'max_price': rng.choice([None, float(rng.randint(1, 40))]),
+                   'available': rng.choice([None, True, False]),
+                   'status': rng.choice([None] + SHOP_STATUSES),
+                   'category': rng.choice([None, 'c0', 'c3', 'nope']),
+                   'shop_id': rng.choice([None, 's1', 's6'])}
+        descending = rng.random() < 0.5
+        expected = sorted(
+            ((shop.shop_id, it.item_id) for shop, cat, it in rows
+             if (filters['min_price'] is None or it.price >= filters['min_price'])
+             and (filters['max_price'] is None or it.price <= filters['max_price'])
+             and (filters['available'] is None or it.available == filters['available'])
+             and (filters['status'] is None or shop.status == filters['status'])
+             and (filters['category'] is None or cat.name == filters['category'])
+             and (filters['shop_id'] is None or shop.shop_id == filters['shop_id'])),
+            key=lambda key: (catalog.get(key[0]).items[key[1]][1].price, doc_of[key]), reverse=descending)
+        got, offset = [], 0
+        while offset is not None:
+            page, offset = catalog.query_items(descending=descending, offset=offset, limit=7, **filters)
+            assert len(page) <= 7
+            got.extend((shop.shop_id, it.item_id) for shop, _, it in page)
+        assert got == expected, filters
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from foodhub import ChangeLog, Item, Menu
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_menu_matches_list_model(columnar):
+    rng = random.Random(7)
+    menu, model, prices, available = Menu(columnar), [], {}, {}
+    for n in range(2000):
+        op = rng.randrange(5)
+        if op == 0 or not model:
+            item_id = f'i{n}'
+            prices[item_id], available[item_id] = float(rng.randint(1, 99)), rng.random() < 0.7
+            assert menu.insert(Item(item_id, f'Item {n}', prices[item_id], available[item_id]))
+            model.append(item_id)
+        elif op == 1:
+            item_id = rng.choice(model)
+            assert menu.delete(item_id)
+            model.remove(item_id)
+            assert not menu.delete(item_id)
+        elif op == 2:
+            item_id = rng.choice(model)
+            after = rng.choice([None] + model)
+            moved = menu.move(item_id, after)
+            assert moved == (item_id != after)
+            if moved:
+                model.remove(item_id)
+                model.insert(model.index(after) + 1 if after else 0, item_id)
+        elif op == 3:
+            item_id = rng.choice(model)
+            available[item_id] = not available[item_id]
+            menu.toggle(item_id, available[item_id])
+        else:
+            item_id = rng.choice(model)
+            prices[item_id] = float(rng.randint(1, 99))
+            menu.set_price(item_id, prices[item_id])
+        if n % 50 == 0:
+            assert [it.item_id for it in menu] == model
+            assert [it.item_id for it in reversed(menu.to_list())] == model[::-1]
+            assert len(menu) == len(model)
+            assert menu.count_available() == sum(available[i] for i in model)
+            if model:
+                stats = menu.price_stats()
+                want = [prices[i] for i in model]
+                assert stats[:2] == (min(want), max(want)) and stats[2] == pytest.approx(sum(want) / len(want))
+            paged, cursor = [], None
+            while True:
+                page, cursor = menu.page(cursor, 13)
+                paged.extend(it.item_id for it in page)
+                if cursor is None:
+                    break
+            assert paged == model
+    assert menu.head is None or menu.head.prev is None
+    assert menu.tail is None or menu.tail.next is None
+
+
+def test_changelog_since_is_complete_or_says_so():
+    log = ChangeLog(retention=10)
+    for n in range(1, 36):
+        log.append('item_added', f'change {n}')
+        for seq in range(n + 1):
+            events, complete = log.since(seq)
+            kept = range(max(1, n - 9), n + 1)
+            if seq + 1 >= kept[0]:
+                assert complete and [e.seq for e in events] == list(range(seq + 1, n + 1))
+            else:
+                # retention dropped some; the reader gets what is left and reloads
+                assert not complete and [e.seq for e in events] == list(kept)
+    assert log.since(35) == ([], True) and log.since(99) == ([], True)
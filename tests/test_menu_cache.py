@@ -0,0 +1,19 @@
+from foodhub import Shop
+
+
+def test_one_hit_or_miss_per_use(open_catalog):
+    catalog = open_catalog(load=False)
+    shop = Shop('s1', 'Tito Jims Grill', 'pw')
+    for n in range(20):
+        shop.add_item('Meals', f'm{n}', f'Meal {n}', 10.0 + n)
+    catalog.add_shop(shop)
+    assert shop.evict()
+    # cold: the use itself counts nothing, the first read loads and misses
+    for _ in range(3):
+        used = catalog.use('s1')
+        for n in range(20):
+            used.find_item(f'm{n}')
+        used.snapshot
+    stats = catalog.menus.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert catalog.get('s1').items and catalog.menus.stats()['hits'] == 2
@@ -0,0 +1,29 @@
+import io
+
+import menu_io
+from foodhub import Shop
+
+
+def test_import_rejects_non_finite_prices():
+    shop = Shop('s1', 'Tito Jims Grill', 'pw')
+    rows = 'category,item_id,name,price\nMeals,m1,Chicken BBQ,inf\nMeals,m2,Pork Sisig,nan\nMeals,m3,Rice,1e400\n'
+    added, errors = menu_io.import_menu(shop, io.StringIO(rows), 'csv')
+    assert added == 0
+    assert [n for n, _ in errors] == [2, 3, 4]
+    assert not shop.items
+
+
+def test_import_reports_undecodable_file():
+    shop = Shop('s1', 'Tito Jims Grill', 'pw')
+    data = 'category,item_id,name,price\nDrinks,d1,Café con leche,90\n'.encode('cp1252')
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    added, errors = menu_io.import_menu(shop, stream, 'csv')
+    assert added == 0
+    assert len(errors) == 1 and 'UTF-8' in errors[0][1]
+
+
+def test_import_rejects_bool_price():
+    shop = Shop('s1', 'Tito Jims Grill', 'pw')
+    rows = '{"category": "Meals", "item_id": "m1", "name": "Chicken BBQ", "price": true}\n'
+    added, errors = menu_io.import_menu(shop, io.StringIO(rows), 'jsonl')
+    assert (added, [n for n, _ in errors]) == (0, [1])
@@ -0,0 +1,46 @@
+def test_orders_survive_restart(stored_catalog, open_catalog):
+    orders = stored_catalog().get('s1').orders
+    first = orders.place('c1', {'m1': 2})
+    second = orders.place('c2', {'m2': 1})
+    orders.complete([o.order_id for o in orders.pop(1)])
+    orders = open_catalog().get('s1').orders
+    assert [o.order_id for o in orders.waiting_orders()] == [first.order_id]
+    assert orders.get(second.order_id).status == 'done'
+    assert orders.get(first.order_id).lines == (('m1', 'Chicken BBQ', 2, 120.0),)
+    assert orders.place('c3', {'m1': 1}).order_id == 's1-3'
+
+
+def test_orders_shared_between_processes(stored_catalog, open_catalog, sync):
+    customer = stored_catalog()
+    vendor = open_catalog()
+    vendor.get('s1').evict()
+    order = customer.get('s1').orders.place('c1', {'m1': 1})
+    version = vendor.get('s1').orders.version
+    sync(vendor)
+    assert vendor.get('s1').orders.version > version
+    assert [o.order_id for o in vendor.get('s1').orders.pop(5)] == [order.order_id]
+    # numbering continues across processes, and an order is only started once
+    assert vendor.get('s1').orders.place('c2', {'m2': 1}).order_id == 's1-2'
+    assert customer.get('s1').orders.pop(5) == []
+    sync(customer)
+    assert customer.get('s1').orders.get(order.order_id).status == 'preparing'
+    assert [o.order_id for o in customer.get('s1').orders.waiting_orders()] == ['s1-2']
+
+
+def test_order_placed_during_sync_is_stored(stored_catalog, open_catalog, sync):
+    writer = stored_catalog()
+    reader = open_catalog()
+    writer.get('s1').set_status('Open')
+    shop = reader.get('s1')
+    placed = []
+    set_status = shop.set_status
+
+    def replaying(status, expected_version=None):
+        # a customer orders while the sync is replaying this shop's rows
+        placed.append(shop.orders.place('c1', {'m1': 1}))
+        return set_status(status, expected_version)
+
+    shop.set_status = replaying
+    sync(reader)
+    assert [row[0] for row in reader.storage.load_shop_orders('s1', 10)] == [placed[0].seq]
+    assert shop.orders.place('c2', {'m2': 1}).order_id == 's1-2'
@@ -0,0 +1,34 @@
+import catalog_snapshot
+import render
+from foodhub import Catalog, Shop
+
+
+def test_status_survives_storage_load(stored_catalog, open_catalog):
+    stored_catalog(status='Open')
+    shop = open_catalog().get('s1')
+    assert shop.summary.status == 'Open'
+    assert 'Status: Open' in render.shop_card_html(shop)
+
+
+def test_status_survives_snapshot_load(tmp_path, stored_catalog, open_catalog):
+    snap = str(tmp_path / 'foodhub.snap')
+    catalog_snapshot.write_snapshot(stored_catalog(status='Open'), snap)
+    catalog = open_catalog(load=False)
+    assert catalog_snapshot.load_snapshot(catalog, snap) == 1
+    assert catalog.get('s1').summary.status == 'Open'
+    assert catalog.get('s1').find_item('m1')[1].name == 'Chicken BBQ'
+
+
+def test_status_of_shop_added_elsewhere(stored_catalog, open_catalog, sync):
+    reader = open_catalog(load=False)
+    stored_catalog(status='Open')
+    sync(reader)
+    assert reader.get('s1').summary.status == 'Open'
+
+
+def test_status_set_before_add_shop():
+    catalog = Catalog()
+    shop = Shop('s2', 'Sweet Bites', 'pw')
+    shop.status = 'Preparing'
+    catalog.add_shop(shop)
+    assert shop.summary.status == 'Preparing'
@@ -0,0 +1,43 @@
+import threading
+
+import catalog_snapshot
+
+
+def test_unloaded_menus_read_after_locks(tmp_path, stored_catalog, open_catalog):
+    snap = str(tmp_path / 'foodhub.snap')
+    catalog = stored_catalog(extra=2)
+    rows = {shop_id: shop.menu_rows() for shop_id, shop in catalog.shops.items()}
+    assert catalog.get('s2').evict()
+    read = catalog.storage.load_shop
+
+    def load_shop(shop_id):
+        # the snapshot reads evicted menus without holding any shop lock
+        free = []
+
+        def probe():
+            for shop in catalog.shops.values():
+                if shop.lock.acquire(blocking=False):
+                    shop.lock.release()
+                    free.append(shop.shop_id)
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        assert free == list(catalog.shops)
+        return read(shop_id)
+
+    catalog.storage.load_shop = load_shop
+    catalog_snapshot.write_snapshot(catalog, snap)
+    restored = open_catalog(load=False)
+    assert catalog_snapshot.load_snapshot(restored, snap) == 3
+    assert {shop_id: shop.menu_rows() for shop_id, shop in restored.shops.items()} == rows
+
+
+def test_truncated_snapshot_falls_back(tmp_path, stored_catalog, open_catalog):
+    snap = str(tmp_path / 'foodhub.snap')
+    catalog_snapshot.write_snapshot(stored_catalog(), snap)
+    with open(snap, 'rb') as f:
+        head = f.read(len(catalog_snapshot.MAGIC) + 4)
+    # cut inside the fixed-size header
+    with open(snap, 'wb') as f:
+        f.write(head)
+    assert catalog_snapshot.load_snapshot(open_catalog(load=False), snap) == 0
@@ -0,0 +1,50 @@
+import pytest
+
+from foodhub import SYNC_REPLAY_LIMIT
+
+
+@pytest.fixture
+def two_processes(stored_catalog, open_catalog):
+    writer = stored_catalog()
+    return writer, open_catalog()
+
+
+def test_small_diff_replays_rows(two_processes, sync):
+    writer, reader = two_processes
+    writer.get('s1').toggle_availability('Meals', 'm1', False)
+    writer.get('s1').set_price('Meals', 'm1', 99.0)
+    sync(reader)
+    shop = reader.get('s1')
+    assert not shop.find_item('m1')[1].available
+    assert shop.changes.recent()[-2:] == ["Item 'Chicken BBQ' marked Sold Out", "Item 'Chicken BBQ' now ₱99.00"]
+
+
+def test_bulk_diff_rebuilds_once(two_processes, sync):
+    writer, reader = two_processes
+    n = SYNC_REPLAY_LIMIT * 10
+    writer.get('s1').bulk_add([(f'c{i % 3}', f'i{i}', f'Item {i}', float(i), True) for i in range(n)])
+    version = reader.get('s1').version
+    sync(reader)
+    shop = reader.get('s1')
+    assert shop.menu_rows() == writer.get('s1').menu_rows()
+    assert shop.version == version + 1
+    assert shop.changes.recent()[-1] == f"Menu updated elsewhere ({n} item(s))"
+    assert ('item', 's1', 'i17') in [k for k, _, _ in reader.search('item 17', 50)[0]]
+    rows, _ = reader.query_items(min_price=n - 1, max_price=n - 1)
+    assert [it.item_id for _, _, it in rows] == [f'i{n - 1}']
+
+
+def test_item_id_taken_elsewhere_before_sync(two_processes, sync):
+    writer, reader = two_processes
+    writer.get('s1').add_item('Meals', 'm3', 'Rice', 15.0)
+    writer.get('s1').add_item('Meals', 'm4', 'Lumpia', 40.0)
+    shop = reader.get('s1')
+    version = shop.version
+    assert not shop.add_item('Drinks', 'm4', 'Iced Tea', 25.0)
+    assert shop.bulk_add([('Drinks', 'm3', 'Soda', 30.0, True), ('Drinks', 'd1', 'Water', 10.0, True)]) == 1
+    assert 'm3' not in shop.items and 'm4' not in shop.items
+    assert shop.version == version + 1
+    sync(reader)
+    sync(writer)
+    assert shop.menu_rows() == writer.get('s1').menu_rows()
+    assert shop.find_item('m3')[1].name == 'Rice'
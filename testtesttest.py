@@ -1,8 +1,31 @@
+import os
+import time
+import uuid
 import streamlit as st
-from collections import deque
-from typing import Optional, List
+from typing import Optional
+from foodhub import Shop, Catalog, SHOP_STATUSES, StaleVersionError, QueueFullError
+from storage import SQLiteStorage
+import io
+import menu_io
+import api
+import catalog_snapshot
+import metrics
+from render import shop_card_html, menu_html, updates_md, snapshot_item
 from streamlit_autorefresh import st_autorefresh # <<< ADDED FOR POLLING
 
+REFRESH_SECONDS = 5
+PAGE_SIZE = 20
+# shops offered by the vendor login lookup
+SHOP_MATCHES = 8
+# FOODHUB_COLUMNAR=1 keeps price/availability columns per category (see foodhub.Menu)
+COLUMNAR = os.environ.get('FOODHUB_COLUMNAR') == '1'
+# binary copy of the catalog for fast restarts (see catalog_snapshot.py)
+SNAPSHOT = os.environ.get('FOODHUB_SNAPSHOT', 'foodhub.snap')
+# most items' worth of menus kept in memory; colder shops are re-read on demand
+MENU_BUDGET = int(os.environ.get('FOODHUB_MENU_BUDGET', '200000'))
+# FOODHUB_DEBUG=1 shows the debug panel to everyone; otherwise open the app with ?debug=1
+DEBUG = os.environ.get('FOODHUB_DEBUG') == '1'
+
 # =========================
 # THEME COLORS 
 # =========================
@@ -15,148 +38,8 @@ TEXT_DARK = "#2E2E2E"
 
 st.set_page_config(page_title="FoodHub Pro Max", layout="wide")
 
-class Item:
-    def __init__(self, item_id: str, name: str, price: float, available: bool=True):
-        self.item_id = item_id
-        self.name = name
-        self.price = price
-        self.available = available
-        self.next = None
-
-class Menu:
-    def __init__(self):
-        self.head: Optional[Item] = None
-
-    def insert(self, node: Item):
-        if not self.head:
-            self.head = node
-            return
-        cur = self.head
-        while cur.next:
-            cur = cur.next
-        cur.next = node
-
-    def delete(self, item_id: str) -> bool:
-        prev = None
-        cur = self.head
-        while cur:
-            if cur.item_id == item_id:
-                if prev:
-                    prev.next = cur.next
-                else:
-                    self.head = cur.next
-                return True
-            prev = cur
-            cur = cur.next
-        return False
-
-    def find(self, item_id: str) -> Optional[Item]:
-        cur = self.head
-        while cur:
-            if cur.item_id == item_id:
-                return cur
-            cur = cur.next
-        return None
-
-    def to_list(self) -> List[Item]:
-        out = []
-        cur = self.head
-        while cur:
-            out.append(cur)
-            cur = cur.next
-        return out
-
-
-class Category:
-    def __init__(self, name: str):
-        self.name = name
-        self.children = {}
-        self.items_list = Menu()
-
-    def add_child(self, child_name: str):
-        if child_name not in self.children:
-            self.children[child_name] = Category(child_name)
-        return self.children[child_name]
-
-    def get_child(self, child_name: str) -> Optional['Category']:
-        return self.children.get(child_name)
-
-    def traverse_preorder(self):
-        stack = [(self, 0)]
-        while stack:
-            node, depth = stack.pop()
-            yield node, depth
-            for child_name in sorted(node.children.keys(), reverse=True):
-                stack.append((node.children[child_name], depth+1))
-
-
-RECENT_LIMIT = 5
-
-class RecentUpdates:
-    def __init__(self, limit=RECENT_LIMIT):
-        self.q = deque(maxlen=limit)
-
-    def enqueue(self, text: str):
-        self.q.append(text)
-
-    def get(self):
-        return list(self.q)
-
-
-class Shop:
-    def __init__(self, shop_id: str, name: str, password: str):
-        self.shop_id = shop_id
-        self.name = name
-        self.password = password
-        self.status = "Closed"
-        self.menu_tree = Category(name)
-        self.recent_updates = RecentUpdates()
-
-    def add_category(self, category_name: str):
-        self.menu_tree.add_child(category_name)
-        self.recent_updates.enqueue(f"Category '{category_name}' added")
-
-    def add_item(self, category_name: str, item_id: str, item_name: str, price: float):
-        cat = self.menu_tree.get_child(category_name)
-        if not cat:
-            cat = self.menu_tree.add_child(category_name)
-        node = Item(item_id, item_name, price, available=True)
-        cat.items_list.insert(node)
-        self.recent_updates.enqueue(f"Added item '{item_name}' to {category_name}")
-
-    def remove_item(self, category_name: str, item_id: str):
-        cat = self.menu_tree.get_child(category_name)
-        if not cat:
-            return False
-        success = cat.items_list.delete(item_id)
-        if success:
-            self.recent_updates.enqueue(f"Removed item {item_id} from {category_name}")
-        return success
-
-    def find_item(self, item_id: str):
-        for node, _ in self.menu_tree.traverse_preorder():
-            found = node.items_list.find(item_id)
-            if found:
-                return node, found
-        return None, None
-
-    def toggle_availability(self, category_name: str, item_id: str, available: bool):
-        cat = self.menu_tree.get_child(category_name)
-        if not cat:
-            return False
-        found = cat.items_list.find(item_id)
-        if not found:
-            return False
-        found.available = available
-        state = "Available" if available else "Sold Out"
-        self.recent_updates.enqueue(f"Item '{found.name}' marked {state}")
-        return True
-
-
-if 'shops' not in st.session_state:
-    st.session_state.shops = {}
-
-    s1 = Shop('s1', 'Tito Jims Grill', 'hesoyam')
+def seed_catalog(catalog: Catalog):
+    s1 = Shop('s1', 'Tito Jims Grill', 'hesoyam', COLUMNAR)
     s1.status = 'Open'
     s1.add_category('Meals')
     s1.add_item('Meals', 'm1', 'Chicken BBQ', 120.0)
@@ -164,12 +47,37 @@ if 'shops' not in st.session_state:
     s1.add_category('Drinks')
     s1.add_item('Drinks', 'd1', 'Iced Tea', 25.0)
 
-    s2 = Shop('s2', 'Sweet Bites', 'stinglikeabee')
+    s2 = Shop('s2', 'Sweet Bites', 'stinglikeabee', COLUMNAR)
     s2.add_category('Desserts')
     s2.add_item('Desserts', 'ds1', 'Chocolate Cake', 60.0)
 
-    st.session_state.shops[s1.shop_id] = s1
-    st.session_state.shops[s2.shop_id] = s2
+    catalog.add_shop(s1)
+    catalog.add_shop(s2)
+
+
+@st.cache_resource
+def get_catalog() -> Catalog:
+    # built once per server process; every session reads and writes the same shops.
+    # edits are written through to SQLite, so a restart just reloads them
+    catalog = Catalog(SQLiteStorage(os.environ.get('FOODHUB_DB', 'foodhub.db')), COLUMNAR, MENU_BUDGET)
+    metrics.gauge('menu_cache', catalog.menus.stats)
+    metrics.gauge('orders', catalog.order_stats)
+    # the snapshot brings menus and indexes back without rebuilding them;
+    # anything written after it is re-read from SQLite
+    if catalog_snapshot.load_snapshot(catalog, SNAPSHOT):
+        catalog_snapshot.start_writer(catalog, SNAPSHOT)
+    else:
+        if not catalog.load():
+            seed_catalog(catalog)
+        catalog_snapshot.start_writer(catalog, SNAPSHOT, now=True)
+    if os.environ.get('FOODHUB_API_PORT'):
+        # JSON read API over this same in-process catalog (see api.py)
+        api.serve_in_thread(catalog, os.environ.get('FOODHUB_API_HOST', '127.0.0.1'), int(os.environ['FOODHUB_API_PORT']))
+    return catalog
+
+catalog = get_catalog()
+# other server processes may share the database; pull in their edits
+catalog.sync()
 
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
@@ -184,42 +92,50 @@ if 'search_shop_results' not in st.session_state:
 if 'search_item_results' not in st.session_state:
     st.session_state.search_item_results = {}
 
+# per-rerun timings (see metrics.py); the view is the one this run starts on
+rerun = metrics.Rerun(profile=st.session_state.get('debug_profile', False))
+rendered_view = st.session_state.view_mode if st.session_state.authenticated else 'login'
+
 
 
 def authenticate_shop(shop_id: str, password: str) -> Optional[Shop]:
-    shop = st.session_state.shops.get(shop_id)
+    shop = catalog.get(shop_id)
     if shop and shop.password == password:
         return shop
     return None
 
-def list_shops():
-    return list(st.session_state.shops.values())
+def find_shops(prefix: str):
+    return catalog.find_shops(prefix, SHOP_MATCHES)
 
-def perform_search(query):
+def perform_search(query, limit=PAGE_SIZE):
     shop_results = []
     item_results = {}
+    st.session_state.search_limit = limit
+    st.session_state.search_total = 0
+    st.session_state.search_fuzzy = False
 
     if not query:
         st.session_state.search_shop_results = []
         st.session_state.search_item_results = {}
         return
 
-    for shop in list_shops():
-        if query.lower() in shop.name.lower() or query.lower() in shop.shop_id.lower():
-            shop_results.append(shop)
-
-        for node, _ in shop.menu_tree.traverse_preorder():
-            for it in node.items_list.to_list():
-                if query.lower() in it.name.lower() or query.lower() in it.item_id.lower():
-                    if shop.shop_id not in item_results:
-                        item_results[shop.shop_id] = []
-                    item_results[shop.shop_id].append((node.name, it))
-    
+    # ranked best-first; item groups keep the order of each shop's best hit
+    results, total = catalog.search(query, limit)
+    for key, payload, score in results:
+        if key[0] == 'shop':
+            shop_results.append(payload)
+        else:
+            cat, it = payload
+            item_results.setdefault(key[1], []).append((cat.name, it))
+
     st.session_state.search_shop_results = shop_results
     st.session_state.search_item_results = item_results
+    st.session_state.search_total = total
+    st.session_state.search_fuzzy = bool(results) and results[0][2] >= catalog.search_index.FUZZY
 
 
 #dto nyu edit ui
+rerun.phase('css')
 st.markdown(
     f"""
     <style>
@@ -324,6 +240,16 @@ st.markdown(
         vertical-align: middle;
     }}
 
+    .menu-item {{
+        background: {OFF_WHITE};
+        padding: 10px 12px;
+        border-radius: 10px;
+        margin-bottom: 8px;
+        display: flex;
+        justify-content: space-between;
+        align-items: center;
+    }}
+
     .muted {{
         color: #666;
         font-size: 0.95rem;
@@ -355,9 +281,17 @@ def show_login_page():
 
         if role == 'Vendor / Shop Owner':
             st.markdown('<div style="margin-top:10px">', unsafe_allow_html=True)
-            shop_id = st.selectbox('Select Shop ID', options=[s.shop_id for s in list_shops()], key="vendor_select")
+            # only the top matches go to the browser, not the whole shop list
+            lookup = st.text_input('Shop ID or name', key="vendor_lookup", placeholder='Start typing your shop ID or name')
+            matches = {s.shop_id: s.name for s in find_shops(lookup)}
+            shop_id = None
+            if matches:
+                shop_id = st.selectbox('Select Shop ID', options=list(matches), key="vendor_select",
+                                       format_func=lambda i: f"{i} — {matches[i]}")
+            elif lookup.strip():
+                st.caption('No shop matches that.')
             pwd = st.text_input('Password', type='password', key="vendor_pwd")
-            if st.button('Login as Vendor', key='vendor_login_btn_v3', use_container_width=True):
+            if st.button('Login as Vendor', key='vendor_login_btn_v3', use_container_width=True, disabled=shop_id is None):
                 shop = authenticate_shop(shop_id, pwd)
                 if shop:
                     st.session_state.authenticated = True
@@ -386,8 +320,166 @@ def show_login_page():
 
 
 
+@st.cache_data(max_entries=64)
+def export_menu(shop_id: str, version: int, fmt: str) -> str:
+    # version is only part of the cache key, so an unchanged menu is not re-serialized
+    out = io.StringIO()
+    (menu_io.write_jsonl if fmt == 'jsonl' else menu_io.write_csv)(catalog.get(shop_id), out)
+    return out.getvalue()
+
+
+def apply_edit(write, seen_version, *args):
+    # optimistic write: rejected if the shop moved on since the vendor's page was rendered
+    try:
+        write(*args, expected_version=seen_version)
+    except StaleVersionError:
+        st.session_state.stale_edit = True
+    st.rerun()
+
+
+def order_lines(order) -> str:
+    return ', '.join(f"{qty} × {name}" for _, name, qty, _ in order.lines)
+
+
+def show_order_form(shop: Shop):
+    # the cart lives in session_state until the order is placed; the shop's
+    # OrderQueue re-checks availability and may push back when it is full
+    customer = st.session_state.setdefault('customer_id', uuid.uuid4().hex[:8])
+    cart = st.session_state.setdefault('cart', {}).setdefault(shop.shop_id, {})
+    available = {v.item_id: v for cat in shop.snapshot.categories for v in cat.items if v.available}
+    if not available:
+        st.info('Nothing is available to order right now.')
+    else:
+        c1, c2, c3 = st.columns([4, 1, 1])
+        item_id = c1.selectbox('Item', options=list(available), key=f'order_item_v3_{shop.shop_id}',
+                               format_func=lambda i: f"{available[i].name} — ₱{available[i].price:.2f}")
+        qty = c2.number_input('Qty', min_value=1, max_value=20, value=1, key=f'order_qty_v3_{shop.shop_id}')
+        if c3.button('Add', key=f'order_add_v3_{shop.shop_id}', use_container_width=True):
+            cart[item_id] = cart.get(item_id, 0) + int(qty)
+    if cart:
+        st.markdown('\n'.join(f"- {qty} × {available[i].name if i in available else i}" for i, qty in cart.items()))
+        o1, o2 = st.columns(2)
+        if o1.button('Place order', key=f'order_place_v3_{shop.shop_id}', use_container_width=True):
+            try:
+                order = shop.orders.place(customer, cart)
+            except QueueFullError:
+                st.warning('This shop has too many orders waiting right now. Please try again in a few minutes.')
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.session_state.setdefault('my_orders', []).append((shop.shop_id, order.order_id))
+                cart.clear()
+                st.rerun()
+        if o2.button('Clear', key=f'order_clear_v3_{shop.shop_id}', use_container_width=True):
+            cart.clear()
+            st.rerun()
+    mine = [shop.orders.get(i) for s, i in st.session_state.get('my_orders', []) if s == shop.shop_id]
+    mine = [o for o in mine if o]
+    if mine:
+        st.caption('Your orders')
+        st.markdown('\n'.join(
+            f"- **{o.order_id}** {order_lines(o)} • ₱{o.total:.2f} • {o.status}"
+            + (f", est. ready {time.strftime('%H:%M', time.localtime(o.due))}" if o.status == 'waiting' else '')
+            for o in reversed(mine)))
+
+
+def show_order_panel(shop: Shop):
+    # vendor side: start the most urgent waiting orders and hand over
+    # finished ones, a batch at a time
+    stats = shop.orders.stats()
+    st.caption(f"{stats['waiting']} of {stats['limit']} waiting • {stats['preparing']} preparing • "
+               f"oldest waiting {stats['oldest_wait'] / 60:.0f} min")
+    waiting = shop.orders.waiting_orders()
+    if waiting:
+        now = time.time()
+        st.markdown('| Order | Items | Prep | Waiting |\n|---|---|---|---|\n' + '\n'.join(
+            f"| {o.order_id} | {order_lines(o)} | {o.prep_seconds / 60:.0f} min | {(now - o.placed_at) / 60:.0f} min |"
+            for o in waiting[:PAGE_SIZE]))
+        b1, b2 = st.columns([1, 2])
+        n = b1.number_input('Batch size', min_value=1, max_value=stats['limit'], value=min(5, stats['limit']),
+                            key=f'order_batch_v3_{shop.shop_id}')
+        if b2.button(f'Start next {int(n)}', key=f'order_pop_v3_{shop.shop_id}', use_container_width=True):
+            shop.orders.pop(int(n))
+            st.rerun()
+    preparing = shop.orders.preparing_orders()
+    if preparing:
+        ids = [o.order_id for o in preparing]
+        labels = {o.order_id: f"{o.order_id}: {order_lines(o)}" for o in preparing}
+        ready = st.multiselect('Preparing', options=ids, default=ids, format_func=labels.get,
+                               key=f'order_ready_v3_{shop.shop_id}')
+        if st.button('Complete selected', key=f'order_done_v3_{shop.shop_id}', disabled=not ready):
+            shop.orders.complete(ready)
+            st.rerun()
+    if not waiting and not preparing:
+        st.info('No open orders.')
+
+
+def paged(key: str, fetch, page_size: int = PAGE_SIZE):
+    # cursor pagination over fetch(cursor, limit) -> (rows, next_cursor).
+    # in "load more" mode the page just grows from the start instead.
+    if st.session_state.get('load_more'):
+        return fetch(None, st.session_state.get(f'{key}_limit', page_size))
+    cursors = st.session_state.get(f'{key}_cursors') or [None]
+    return fetch(cursors[-1], page_size)
+
+
+def pager_controls(key: str, next_cursor, page_size: int = PAGE_SIZE):
+    if st.session_state.get('load_more'):
+        if next_cursor and st.button('Load more', key=f'{key}_more'):
+            st.session_state[f'{key}_limit'] = st.session_state.get(f'{key}_limit', page_size) + page_size
+            st.rerun()
+        return
+    cursors = st.session_state.get(f'{key}_cursors') or [None]
+    if len(cursors) == 1 and not next_cursor:
+        return
+    prev_col, info_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if len(cursors) > 1 and st.button('‹ Prev', key=f'{key}_prev', use_container_width=True):
+            st.session_state[f'{key}_cursors'] = cursors[:-1]
+            st.rerun()
+    info_col.caption(f"Page {len(cursors)}")
+    with next_col:
+        if next_cursor and st.button('Next ›', key=f'{key}_next', use_container_width=True):
+            st.session_state[f'{key}_cursors'] = cursors + [next_cursor]
+            st.rerun()
+
+
+def refresh_token():
+    # what the current page was built from; the page only needs a rerun when this moves
+    mode = st.session_state.view_mode
+    if mode == 'shops':
+        return mode, catalog.listing_version
+    if mode == 'search':
+        return mode, catalog.version
+    shop = catalog.get(st.session_state.get('current_shop'))
+    if not shop:
+        return mode, None
+    # orders change without touching the menu: the vendor's panel always
+    # shows them, a customer's page only once they have ordered here
+    orders = None
+    if mode == 'vendor_dashboard' or any(s == shop.shop_id for s, _ in st.session_state.get('my_orders', ())):
+        orders = shop.orders.version
+    return mode, shop.etag, orders
+
+
+def watch_for_changes():
+    catalog.sync()
+    if refresh_token() != st.session_state.get('rendered_token'):
+        st.rerun()
+
+
+if hasattr(st, 'fragment'):
+    # the poll reruns only this (empty) fragment, so an idle page sends nothing
+    watch_for_changes = st.fragment(run_every=REFRESH_SECONDS)(watch_for_changes)
+
+
 def show_home_page():
-    st_autorefresh(interval=5000, key="data_refresher_v4")
+    rerun.phase('header')
+    st.session_state.rendered_token = refresh_token()
+    if hasattr(st, 'fragment'):
+        watch_for_changes()
+    else:
+        st_autorefresh(interval=REFRESH_SECONDS * 1000, key="data_refresher_v4")
 
     with st.container():
         st.markdown('<div class="main-header-card">', unsafe_allow_html=True)
@@ -404,7 +496,7 @@ def show_home_page():
             with cols[1]:
                 if st.button('Dashboard', key='nav_dashboard_v3', use_container_width=True):
                     if 'current_shop' not in st.session_state:
-                        shops = list_shops()
+                        shops, _ = catalog.page_shops(limit=1)
                         if shops:
                             st.session_state.current_shop = shops[0].shop_id
                     st.session_state.view_mode = 'vendor_dashboard'
@@ -438,9 +530,7 @@ def show_home_page():
                 c1, c2 = st.columns([1,1])
                 with c1:
                     if st.button("Yes, logout", key="confirm_logout_v3"):
-                        shops = st.session_state.get('shops', {})
                         st.session_state.clear()
-                        st.session_state.shops = shops
                         st.session_state.authenticated = False
                         st.session_state.view_mode = 'shops'
                         st.session_state.show_logout_confirm = False
@@ -455,6 +545,7 @@ def show_home_page():
 
     st.markdown("<div style='height:6px'></div>", unsafe_allow_html=True)
     st.markdown("---")
+    rerun.phase(f'view.{st.session_state.view_mode}')
 
     if st.session_state.view_mode == 'search':
         st.subheader("Search Shops & Items")
@@ -471,6 +562,7 @@ def show_home_page():
             
             if shop_results:
                 st.markdown("### Shops")
+                metrics.count('widgets_created', len(shop_results))
                 for shop in shop_results:
                     c = st.container()
                     with c:
@@ -487,7 +579,14 @@ def show_home_page():
             if item_results:
                 st.markdown("### Items Found")
                 for shop_id, items in item_results.items():
-                    shop = st.session_state.shops[shop_id]
+                    shop = catalog.use(shop_id)
+                    # show the published state; hits removed since the search drop out
+                    items = [(cat_name, v) for cat_name, v in
+                             ((cat_name, snapshot_item(shop, cat_name, it.item_id)) for cat_name, it in items) if v]
+                    if not items:
+                        continue
+                    metrics.count('items_rendered', len(items))
+                    metrics.count('widgets_created', len(items))
                     with st.expander(f"{shop.name} — {len(items)} item(s)"):
                         for cat_name, it in items:
                             row_container = st.container()
@@ -502,35 +601,67 @@ def show_home_page():
                                         st.session_state.view_mode = 'shop_detail'
                                         st.rerun()
 
+            if st.session_state.get('search_fuzzy'):
+                st.caption("No exact matches, showing close matches.")
+
+            shown = st.session_state.get('search_limit', PAGE_SIZE)
+            if st.session_state.get('search_total', 0) > shown:
+                st.button('More results', key='search_more_v3', on_click=perform_search, args=(query, shown + PAGE_SIZE))
+
             if not shop_results and not item_results and query:
                 st.info("No results found.")
 
+        with st.expander('Browse items by price and availability'):
+            f1, f2, f3 = st.columns(3)
+            min_price = f1.number_input('Min price', min_value=0.0, format='%.2f', key='q_min_v3')
+            max_price = f2.number_input('Max price (0 = any)', min_value=0.0, format='%.2f', key='q_max_v3')
+            sort = f3.selectbox('Sort', ['Price: low to high', 'Price: high to low'], key='q_sort_v3')
+            g1, g2, g3 = st.columns(3)
+            only_available = g1.checkbox('Available only', key='q_avail_v3')
+            only_open = g2.checkbox('Open shops only', key='q_open_v3')
+            category = g3.selectbox('Category', ['All'] + catalog.query_index.categories(), key='q_cat_v3')
+            filters = dict(min_price=min_price or None, max_price=max_price or None,
+                           available=True if only_available else None, status='Open' if only_open else None,
+                           category=None if category == 'All' else category, descending=sort == 'Price: high to low')
+            # a new filter combination starts again from the first page
+            page_key = 'query_page_' + str(abs(hash(tuple(filters.items()))))
+            rows, next_cursor = paged(page_key, lambda cursor, limit: catalog.query_items(offset=cursor or 0, limit=limit, **filters))
+            rows = [(shop, cat.name, snapshot_item(shop, cat.name, it.item_id)) for shop, cat, it in rows]
+            metrics.count('items_rendered', len(rows))
+            if rows:
+                st.markdown('| Item | Price | Shop | Category | |\n|---|---|---|---|---|\n' + '\n'.join(
+                    f"| {it.name} | ₱{it.price:.2f} | {shop.name} ({shop.status}) | {cat_name} | {'Available' if it.available else 'Sold Out'} |"
+                    for shop, cat_name, it in rows if it))
+            else:
+                st.info('No items match these filters.')
+            pager_controls(page_key, next_cursor)
+
     elif st.session_state.view_mode == 'shops':
         st.session_state.search_shop_results = []
         st.session_state.search_item_results = []
 
         st.subheader('Available Shops')
-        shops = list_shops()
+        st.checkbox('Load more instead of pages', value=st.session_state.get('load_more', False),
+                    key='load_more_box', on_change=lambda: st.session_state.update(load_more=st.session_state.load_more_box))
+        shops, next_cursor = paged('shops_page', catalog.page_shops)
+        # widgets_created counts the per-row widgets, the ones that grow with the data
+        metrics.count('shops_rendered', len(shops))
+        metrics.count('widgets_created', len(shops))
         for shop in shops:
             c = st.container()
             with c:
-                st.markdown(
-                    f"<div class='shop-card'><div style='display:flex; justify-content:space-between; align-items:center; gap:16px;'>"
-                    f"<div style='display:flex; align-items:center; gap:12px;'><div class='accent-strip'></div>"
-                    f"<div><strong style='font-size:1.05rem'>{shop.name}</strong><div class='muted'>Status: {shop.status} • ID: {shop.shop_id}</div></div>"
-                    f"</div></div></div>",
-                    unsafe_allow_html=True)
+                st.markdown(shop_card_html(shop), unsafe_allow_html=True)
                 if st.button("View Details", key=f"open_v3_{shop.shop_id}", use_container_width=True):
                     st.session_state.current_shop = shop.shop_id
                     st.session_state.view_mode = 'shop_detail'
                     st.rerun()
-            st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
+        pager_controls('shops_page', next_cursor)
 
     elif st.session_state.view_mode == 'shop_detail' and st.session_state.get('current_shop'):
         st.session_state.search_shop_results = []
         st.session_state.search_item_results = []
         
-        shop = st.session_state.shops[st.session_state.current_shop]
+        shop = catalog.use(st.session_state.current_shop)
 
         st.markdown(
             f"<div class='shop-detail-card' style='display:flex; justify-content:space-between; align-items:center; gap:12px;'>"
@@ -556,45 +687,42 @@ def show_home_page():
         st.markdown(f"<div style='display:flex; align-items:center; gap:10px; margin-bottom:8px;'>"
                     f"<div class='accent-strip'></div><div class='section-title'>Menu</div></div>", unsafe_allow_html=True)
 
-        for node, depth in shop.menu_tree.traverse_preorder():
-            if node is shop.menu_tree:
-                continue
-            st.markdown(f"**{node.name}**")
-            items = node.items_list.to_list()
-            if not items:
-                st.write(f"- (no items)")
-            else:
-                for it in items:
-                    status = 'Available' if it.available else 'Sold Out'
-                    st.markdown(
-                        f"<div style='background:{OFF_WHITE}; padding:10px 12px; border-radius:10px; margin-bottom:8px; "
-                        f"display:flex; justify-content:space-between; align-items:center;'>"
-                        f"<div><strong>{it.name}</strong><div class='muted'>ID: {it.item_id} • {status}</div></div>"
-                        f"<div style='min-width:110px; text-align:right;'>₱{it.price:.2f}</div></div>",
-                        unsafe_allow_html=True)
+        menu_limit = st.session_state.get(f'menu_limit_{shop.shop_id}', PAGE_SIZE)
+        st.markdown(menu_html(shop, menu_limit), unsafe_allow_html=True)
+        metrics.count('items_rendered', sum(min(len(cat.items), menu_limit) for cat in shop.snapshot.categories))
+        if any(len(cat.items) > menu_limit for cat in shop.snapshot.categories):
+            if st.button('Show more items', key=f'menu_more_{shop.shop_id}'):
+                st.session_state[f'menu_limit_{shop.shop_id}'] = menu_limit + PAGE_SIZE
+                st.rerun()
+
+        if shop.status != 'Closed':
+            with st.expander('Order from this shop'):
+                show_order_form(shop)
 
         st.markdown("---")
         st.markdown(f"<div style='display:flex; align-items:center; gap:10px; margin-bottom:8px;'>"
                     f"<div class='accent-strip'></div><div class='section-title'>Recent Updates</div></div>", unsafe_allow_html=True)
-        updates = shop.recent_updates.get()
-        if updates:
-            for u in reversed(updates):
-                st.write('- ' + u)
-        else:
-            st.write('No updates yet')
+        st.markdown(updates_md(shop.changes.recent()))
 
     elif st.session_state.view_mode == 'vendor_dashboard' and st.session_state.get('current_shop'):
-        shop = st.session_state.shops[st.session_state.current_shop]
+        shop = catalog.use(st.session_state.current_shop)
         st.subheader(f"Vendor Dashboard — {shop.name}")
 
-        new_status = st.selectbox('Shop Status', ['Open', 'Closed', 'Preparing'], key=f'vendor_status_v3',
-                                 index=['Open','Closed','Preparing'].index(shop.status) if shop.status in ['Open','Closed','Preparing'] else 1)
+        # edits are checked against the version this vendor last saw rendered
+        seen_version = st.session_state.get('dashboard_version')
+        st.session_state.dashboard_version = shop.version
+        if st.session_state.pop('stale_edit', False):
+            st.warning('The menu was changed elsewhere, so your last action was not applied. Please check and try again.')
+
+        new_status = st.selectbox('Shop Status', SHOP_STATUSES, key=f'vendor_status_v3',
+                                 index=SHOP_STATUSES.index(shop.status) if shop.status in SHOP_STATUSES else 1)
         if st.button('Update Status', key=f'update_status_v3_{shop.shop_id}', use_container_width=False):
             if new_status != shop.status:
-                shop.status = new_status
-                shop.recent_updates.enqueue(f"Shop status changed to {new_status}")
-                st.success('Status updated')
-                st.rerun()
+                apply_edit(shop.set_status, seen_version, new_status)
+
+        st.markdown('---')
+        st.markdown('### Orders')
+        show_order_panel(shop)
 
         st.markdown('---')
         st.markdown('### Menu Management')
@@ -626,21 +754,87 @@ def show_home_page():
                     if not item_id.strip() or not item_name.strip():
                         st.error('Provide item id and name')
                     else:
-                        _, found = shop.find_item(item_id)
-                        if found:
-                            st.error('Item ID already exists')
-                        else:
-                            shop.add_item(cat, item_id.strip(), item_name.strip(), float(price))
+                        if shop.add_item(cat, item_id.strip(), item_name.strip(), float(price)):
                             st.success(f"Item '{item_name}' added to {cat}")
                             st.rerun()
+                        else:
+                            st.error('Item ID already exists')
+
+        with st.expander('Import / Export Menu'):
+            st.caption('Columns: ' + ', '.join(menu_io.FIELDS) + ' (available is optional)')
+            imported = st.session_state.pop('imported', None)
+            if imported is not None:
+                st.success(f"Imported {imported} item(s)")
+            # a new key after each import clears the uploader
+            n_imports = st.session_state.get('n_imports', 0)
+            upload = st.file_uploader('CSV or JSON Lines file', type=['csv', 'jsonl'],
+                                      key=f'import_file_v3_{shop.shop_id}_{n_imports}')
+            if upload and st.button('Import', key=f'import_btn_v3_{shop.shop_id}'):
+                fmt = 'jsonl' if upload.name.lower().endswith('.jsonl') else 'csv'
+                added, errors = menu_io.import_menu(shop, io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''), fmt)
+                if errors:
+                    st.error(f"Nothing imported, {len(errors)} row(s) failed validation:")
+                    st.markdown('\n'.join(f"- line {n}: {msg}" for n, msg in errors[:10]))
+                else:
+                    st.session_state.imported = added
+                    st.session_state.n_imports = n_imports + 1
+                    st.rerun()
+            dl1, dl2 = st.columns(2)
+            dl1.download_button('Export CSV', export_menu(shop.shop_id, shop.version, 'csv'),
+                                file_name=f'{shop.shop_id}_menu.csv', mime='text/csv')
+            dl2.download_button('Export JSONL', export_menu(shop.shop_id, shop.version, 'jsonl'),
+                                file_name=f'{shop.shop_id}_menu.jsonl', mime='application/jsonl')
+
+        with st.expander('Batch Edit Items'):
+            # edits stay in the browser until submitted, then go in as one write
+            all_cats = list(shop.menu_tree.children.keys())
+            if not all_cats:
+                st.info('No categories yet. Add a category first.')
+            else:
+                batch_cat = st.selectbox('Category', options=all_cats, key=f'batch_cat_v3_{shop.shop_id}')
+                page_key = f'batch_page_{shop.shop_id}_{batch_cat}'
+                items, next_cursor = paged(page_key, shop.menu_tree.children[batch_cat].items_list.page)
+                metrics.count('items_rendered', len(items))
+                rows = [{'item_id': it.item_id, 'name': it.name, 'price': it.price,
+                         'available': it.available, 'remove': False} for it in items]
+                with st.form(f'batch_form_v3_{shop.shop_id}_{batch_cat}'):
+                    # keyed on the version, so an applied batch doesn't replay onto the new rows
+                    edited = st.data_editor(
+                        rows, key=f'batch_grid_v3_{shop.shop_id}_{batch_cat}_{shop.version}',
+                        disabled=['item_id'], hide_index=True, use_container_width=True,
+                        column_config={
+                            'item_id': st.column_config.TextColumn('Item ID'),
+                            'name': st.column_config.TextColumn('Name', required=True),
+                            'price': st.column_config.NumberColumn('Price', min_value=0.0, format='%.2f', required=True),
+                            'available': st.column_config.CheckboxColumn('Available'),
+                            'remove': st.column_config.CheckboxColumn('Remove'),
+                        })
+                    submitted = st.form_submit_button('Apply changes', use_container_width=True)
+                if submitted:
+                    bad = [r['item_id'] for r in edited if not (r['name'] or '').strip() or r['price'] is None]
+                    if bad:
+                        st.error(f"Name and price are required: {', '.join(bad)}")
+                    else:
+                        apply_edit(shop.edit_items, seen_version,
+                                   [(r['item_id'], r['name'].strip(), float(r['price']), bool(r['available']), bool(r['remove']))
+                                    for r in edited])
+                pager_controls(page_key, next_cursor)
 
         with st.expander('Edit / Remove Items'):
+            st.caption(f"Sold out: {shop.sold_out_ratio():.0%} of items")
+            stats = shop.category_stats()
             for cat_name, cat_node in shop.menu_tree.children.items():
                 st.markdown(f"**Category: {cat_name}**")
-                items = cat_node.items_list.to_list()
+                count, available, prices = stats[cat_name]
+                if prices:
+                    st.caption(f"{count} item(s) • {available} available • ₱{prices[0]:.2f}–₱{prices[1]:.2f}, avg ₱{prices[2]:.2f}")
+                page_key = f'edit_page_{shop.shop_id}_{cat_name}'
+                items, next_cursor = paged(page_key, cat_node.items_list.page)
                 if not items:
                     st.info('No items in this category')
                     continue
+                metrics.count('items_rendered', len(items))
+                metrics.count('widgets_created', sum(3 if it.prev else 2 for it in items))
                 for it in items:
                     cols = st.columns([2,1,1,1])
                     cols[0].write(f"{it.item_id} — {it.name}")
@@ -649,24 +843,62 @@ def show_home_page():
                     cols[2].write(avail)
                     
                     if cols[3].button('Toggle', key=f"tog_v3_{shop.shop_id}_{it.item_id}", use_container_width=True):
-                        shop.toggle_availability(cat_name, it.item_id, not it.available)
-                        st.rerun()
+                        apply_edit(shop.toggle_availability, seen_version, cat_name, it.item_id, not it.available)
 
                     if cols[3].button('Remove', key=f"rem_v3_{shop.shop_id}_{it.item_id}", use_container_width=True):
-                        shop.remove_item(cat_name, it.item_id)
-                        st.rerun()
+                        apply_edit(shop.remove_item, seen_version, cat_name, it.item_id)
 
-        st.markdown('---')
-        st.subheader('Recent Updates')
-        updates = shop.recent_updates.get()
-        if updates:
-            for u in reversed(updates):
-                st.write('- ' + u)
-        else:
-            st.write('No updates yet')
+                    if it.prev and cols[3].button('Move Up', key=f"up_v3_{shop.shop_id}_{it.item_id}", use_container_width=True):
+                        before = it.prev.prev
+                        apply_edit(shop.move_item, seen_version, cat_name, it.item_id, before.item_id if before else None)
 
+                pager_controls(page_key, next_cursor)
 
-if not st.session_state.authenticated:
-    show_login_page()
-else:
-    show_home_page()
\ No newline at end of file
+        st.markdown('---')
+        st.subheader('Recent Updates')
+        st.markdown(updates_md(shop.changes.recent()))
+
+
+def finish_rerun():
+    st.session_state.debug_last_rerun = rerun.finish(rendered_view)
+
+
+def show_debug_panel():
+    # hidden unless ?debug=1 (or FOODHUB_DEBUG=1); shows the previous rerun,
+    # since this one is still running
+    with st.sidebar.expander('Debug: performance', expanded=True):
+        st.checkbox('Profile reruns (cProfile)', key='debug_profile')
+        last = st.session_state.get('debug_last_rerun')
+        if last:
+            st.caption(f"Last rerun: {last['view']} in {last['seconds'] * 1000:.1f} ms")
+            st.markdown('| Span | ms |\n|---|---|\n' + '\n'.join(
+                f"| {name} | {sec * 1000:.2f} |" for name, sec in sorted(last['spans'].items(), key=lambda kv: -kv[1])))
+            if last['counters']:
+                st.markdown('\n'.join(f"- {name}: {n}" for name, n in sorted(last['counters'].items())))
+            if last.get('profile'):
+                st.code(last['profile'], language=None)
+        spans, _ = metrics.snapshot()
+        menus = get_catalog().menus.stats()
+        st.caption(f"Menus in memory: {menus['resident_shops']} shops, {menus['resident_items']} items "
+                   f"(budget {menus['budget']}) • hits {menus['hits']}, misses {menus['misses']}, "
+                   f"evictions {menus['evictions']}")
+        st.caption('Process totals')
+        st.markdown('| Span | runs | avg ms | max ms |\n|---|---|---|---|\n' + '\n'.join(
+            f"| {name} | {n} | {total / n * 1000:.2f} | {worst * 1000:.2f} |"
+            for name, (n, total, worst) in sorted(spans.items())))
+        st.download_button('Prometheus metrics', metrics.prometheus(), file_name='foodhub_metrics.txt', mime='text/plain')
+
+
+if DEBUG or st.query_params.get('debug') == '1':
+    rerun.phase('debug_panel')
+    show_debug_panel()
+
+try:
+    if not st.session_state.authenticated:
+        rerun.phase('view.login')
+        show_login_page()
+    else:
+        show_home_page()
+finally:
+    # also runs when st.rerun() cuts the script short
+    finish_rerun()
\ No newline at end of file